@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Auth on an asyncio event loop. Requires Python 3, and uses aiohttp if it
+is installed."""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread, Lock
+from time import monotonic
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import METRICS
+from qrcodescanner import prepare_msg, request_auth
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncAuthClient(object):
+    """Auths against the server on an asyncio event loop, which runs on a
+    background thread.
+
+    Up to max_in_flight requests run concurrently, over a pooled session.
+    With aiohttp, requests are native coroutines. Without it, requests are
+    sent with a shared requests.Session on an executor. Each QR code's
+    request may be cancelled, until it starts. Results are put on the
+    queue, as (qrcode, response), for the UI loop to drain in bulk.
+    """
+    def __init__(
+        self,
+        queue,
+        url,
+        max_in_flight=8,
+        timeout=5,
+        retries=2,
+        backoff=0.5,
+        quality=80,
+        scale=0.5
+    ):
+        self.queue = queue
+        self.url = url
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.quality = quality
+        self.scale = scale
+        self.cancelled = 0
+        # QR code to (future, state), where state says whether the request
+        # has started, or was cancelled before it did.
+        self.futures = {}
+        self._lock = Lock()
+        # Encoding pictures, and requests without aiohttp, run here.
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.call(self._start()).result()
+
+    def call(self, coroutine):
+        """Schedule the coroutine on the event loop, from any thread"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def _start(self):
+        self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        if aiohttp is not None:
+            connector = aiohttp.TCPConnector(limit=self.max_in_flight)
+            self.session = aiohttp.ClientSession(connector=connector)
+        else:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.max_in_flight
+            )
+            self.session.mount('http://', adapter)
+            self.session.mount('https://', adapter)
+
+    def submit(self, qrcode, picture, timestamp):
+        """Start the request, without blocking"""
+        state = dict(started=False, cancelled=False)
+        future = self.call(self._auth(qrcode, picture, timestamp, state))
+        with self._lock:
+            self.futures[qrcode] = (future, state)
+        future.add_done_callback(
+            lambda future: self._forget(qrcode, future)
+        )
+        return True
+
+    def _forget(self, qrcode, future):
+        with self._lock:
+            entry = self.futures.get(qrcode)
+            if entry is not None and entry[0] is future:
+                del self.futures[qrcode]
+
+    def cancel(self, qrcode):
+        """Cancel the QR code's request, if it hasn't started. Returns True
+        if it was cancelled.
+
+        A request that has started isn't cancelled, as the server may have
+        already authed the QR code, and its response is put on the queue as
+        usual. Without aiohttp, it couldn't be anyway, as requests on the
+        executor can't be interrupted.
+        """
+        with self._lock:
+            entry = self.futures.get(qrcode)
+            if entry is None or entry[1]['started']:
+                return False
+            future, state = entry
+            state['cancelled'] = True
+        future.cancel()
+        self.cancelled += 1
+        # Let the UI loop clear the active QR code.
+        self.queue.put((qrcode, None))
+        return True
+
+    def pending(self):
+        """Number of requests in flight"""
+        return len(self.futures)
+
+    async def _auth(self, qrcode, picture, timestamp, state):
+        # A result is always put on the queue, so the UI loop clears the
+        # active QR code. Cancelled requests are put by cancel().
+        response = None
+        try:
+            async with self.semaphore:
+                with self._lock:
+                    if state['cancelled']:
+                        return
+                    state['started'] = True
+                if aiohttp is not None:
+                    response = await self._post(qrcode, picture, timestamp)
+                else:
+                    response = await self.loop.run_in_executor(
+                        self.executor,
+                        lambda: request_auth(
+                            self.url,
+                            qrcode,
+                            picture,
+                            timestamp,
+                            timeout=self.timeout,
+                            session=self.session,
+                            retries=self.retries,
+                            backoff=self.backoff,
+                            quality=self.quality,
+                            scale=self.scale
+                        )
+                    )
+        except Exception:
+            logger.exception('Auth failed for {}'.format(qrcode))
+        self.queue.put((qrcode, response))
+
+    async def _post(self, qrcode, picture, timestamp):
+        """POST with aiohttp, retrying with exponential backoff on connect
+        errors"""
+        filename, data, files = await self.loop.run_in_executor(
+            self.executor,
+            lambda: prepare_msg(
+                qrcode,
+                picture,
+                timestamp,
+                quality=self.quality,
+                scale=self.scale
+            )
+        )
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        start = monotonic()
+        for attempt in range(self.retries + 1):
+            # Form data can only be sent once.
+            form = aiohttp.FormData()
+            for name, value in data.items():
+                form.add_field(name, value)
+            for name, (filename, content, content_type) in files.items():
+                form.add_field(
+                    name,
+                    content,
+                    filename=filename,
+                    content_type=content_type
+                )
+            try:
+                async with self.session.post(
+                    self.url, data=form, timeout=timeout
+                ) as r:
+                    response = await r.json(content_type=None)
+            except aiohttp.ClientConnectorError:
+                # Not connected, so the server never saw the request.
+                if attempt == self.retries:
+                    return None
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+            except asyncio.TimeoutError:
+                # The server may have seen the request, so don't resend it.
+                return dict(network_timeout=True)
+            except Exception:
+                logger.exception('Auth failed for {}'.format(qrcode))
+                return None
+            else:
+                METRICS.observe('http', monotonic() - start)
+                return response
+
+    async def _close(self):
+        if aiohttp is not None:
+            await self.session.close()
+        else:
+            self.session.close()
+
+    def stop(self):
+        """Cancel requests not yet started, and stop the event loop"""
+        for qrcode in list(self.futures):
+            self.cancel(qrcode)
+        self.call(self._close()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.executor.shutdown(wait=False)
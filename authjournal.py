@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import datetime
+import logging
+import sqlite3
+from collections import deque
+from threading import Thread, Condition
+import requests
+from compat import monotonic
+from metrics import METRICS
+from qrcodescanner import encode_picture, post
+
+logger = logging.getLogger(__name__)
+
+
+class AuthJournal(object):
+    """Store and forward auths, by way of an SQLite journal.
+
+    Each auth is written to the journal as soon as it's submitted, then
+    uploaded in batches of up to batch_size, once there are that many or
+    the oldest has waited linger seconds. If the server is slow or down,
+    entries stay in the journal, and are retried with exponential backoff.
+    Entries left unsent when the process stopped are replayed on start.
+
+    A batch is a single POST of a JSON list of entries, as the form field
+    batch, with each entry's picture as the file picture_<index>. The server
+    responds with a JSON list of responses, one per entry, in order. Each
+    response is put on the queue, as (qrcode, response), as with auth pools.
+    When an upload fails, network_timeout is put once for each unsent entry
+    instead. Sent entries are kept for retention seconds.
+
+    Connect errors, timeouts and 5xx responses are outages, so entries are
+    retried until they're sent. Anything else, a 4xx response, a reply that
+    isn't a list with one response per entry, or an entry that can't be
+    encoded, is a rejection. A rejected batch is retried an entry at a
+    time, so one bad entry doesn't hold back the others. An entry rejected
+    max_attempts times is dead lettered, with (qrcode, None) put on the
+    queue, and kept for retention seconds.
+    """
+    def __init__(
+        self,
+        queue,
+        url,
+        path,
+        batch_size=10,
+        linger=1.0,
+        timeout=5,
+        retries=0,
+        backoff=0.5,
+        max_backoff=60.0,
+        max_attempts=3,
+        retention=86400,
+        quality=80,
+        scale=0.5
+    ):
+        self.queue = queue
+        self.url = url
+        self.path = path
+        self.batch_size = batch_size
+        self.linger = linger
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.quality = quality
+        self.scale = scale
+        self.sent = 0
+        self.dead = 0
+        self.failures = 0
+        self.session = requests.Session()
+        # Submitted entries, not yet written to the journal.
+        self._appends = deque()
+        self._unsent = 0
+        # When the oldest unsent entry was written, and when to retry.
+        self._oldest = None
+        self._retry_at = None
+        # Entries still to be sent one at a time, after a batch was rejected.
+        self._isolate = 0
+        self._stopped = False
+        self._condition = Condition()
+        # Opened now, so a bad path fails here rather than on the worker.
+        self._connection = self._connect()
+        self._thread = Thread(target=self._worker)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, qrcode, picture, timestamp):
+        """Journal the auth, without blocking. Always accepted. If the auth
+        can't be journaled, (qrcode, None) is put on the queue"""
+        with self._condition:
+            self._appends.append((qrcode, picture, timestamp))
+            self._condition.notify()
+        return True
+
+    def pending(self):
+        """Number of entries not yet sent"""
+        with self._condition:
+            return len(self._appends) + self._unsent
+
+    def _connect(self):
+        # Only used from the worker thread, once it's started.
+        connection = sqlite3.connect(
+            self.path, timeout=5, check_same_thread=False
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS journal ('
+            'id INTEGER PRIMARY KEY, qrcode TEXT, timestamp TEXT, '
+            'picture BLOB, attempts INTEGER DEFAULT 0, '
+            'rejections INTEGER DEFAULT 0, sent REAL, failed REAL)'
+        )
+        connection.execute(
+            'CREATE INDEX IF NOT EXISTS journal_sent ON journal (sent)'
+        )
+        connection.commit()
+        return connection
+
+    def _worker(self):
+        connection = self._connection
+        unsent = connection.execute(
+            'SELECT COUNT(*) FROM journal '
+            'WHERE sent IS NULL AND failed IS NULL'
+        ).fetchone()[0]
+        with self._condition:
+            self._unsent = unsent
+            if unsent:
+                logger.info('Replaying {} journaled auths'.format(unsent))
+                # Entries from a previous run have waited long enough.
+                self._oldest = monotonic() - self.linger
+        while True:
+            with self._condition:
+                while not self._stopped and not self._appends:
+                    timeout = self._wait_time()
+                    if timeout is not None and timeout <= 0:
+                        break
+                    self._condition.wait(timeout)
+                stopped = self._stopped
+                appends = list(self._appends)
+                self._appends.clear()
+            if appends:
+                try:
+                    self._append(connection, appends)
+                except Exception:
+                    logger.exception('Journal write failed')
+                    METRICS.increment('journal_write_failed')
+                    # Let the UI loop clear the active QR codes.
+                    for qrcode, _, _ in appends:
+                        self.queue.put((qrcode, None))
+            if stopped:
+                break
+            timeout = self._wait_time()
+            if timeout is not None and timeout <= 0:
+                try:
+                    self._upload(connection)
+                except Exception:
+                    logger.exception('Journal upload failed')
+                    self._retry_later()
+        connection.close()
+        self.session.close()
+
+    def _wait_time(self):
+        """Seconds until the next upload is due, or None if nothing is"""
+        if not self._unsent:
+            return None
+        now = monotonic()
+        if self._unsent >= self.batch_size or self._isolate:
+            due = now
+        else:
+            due = self._oldest + self.linger
+        if self._retry_at is not None:
+            due = max(due, self._retry_at)
+        return due - now
+
+    def _append(self, connection, appends):
+        rows = []
+        for qrcode, picture, timestamp in appends:
+            jpeg = encode_picture(
+                picture, quality=self.quality, scale=self.scale
+            )
+            rows.append((
+                qrcode,
+                datetime.datetime.strftime(timestamp, '%Y%m%d%H%M%S%f'),
+                sqlite3.Binary(jpeg)
+            ))
+        # One transaction for every entry submitted since the last write.
+        with connection:
+            connection.executemany(
+                'INSERT INTO journal (qrcode, timestamp, picture) '
+                'VALUES (?, ?, ?)',
+                rows
+            )
+        with self._condition:
+            if not self._unsent:
+                self._oldest = monotonic()
+            self._unsent += len(rows)
+        METRICS.increment('journal_appended', len(rows))
+
+    def _upload(self, connection):
+        limit = 1 if self._isolate else self.batch_size
+        rows = connection.execute(
+            'SELECT id, qrcode, timestamp, picture FROM journal '
+            'WHERE sent IS NULL AND failed IS NULL ORDER BY id LIMIT ?',
+            (limit, )
+        ).fetchall()
+        if not rows:
+            with self._condition:
+                self._unsent = 0
+            return
+        batch, files = [], {}
+        for index, (_, qrcode, timestamp, picture) in enumerate(rows):
+            filename = '{}.jpeg'.format(timestamp)
+            batch.append(dict(
+                qrcode=qrcode, timestamp=timestamp, picture=filename
+            ))
+            files['picture_{}'.format(index)] = (
+                filename, bytes(picture), 'image/jpeg'
+            )
+        try:
+            data = dict(batch=json.dumps(batch))
+        except (TypeError, ValueError) as e:
+            self._upload_rejected(connection, rows, e)
+            return
+        start = monotonic()
+        try:
+            r = post(
+                self.session,
+                self.url,
+                data,
+                files,
+                timeout=self.timeout,
+                retries=self.retries,
+                backoff=self.backoff
+            )
+        except requests.exceptions.RequestException as e:
+            self._upload_failed(connection, e)
+            return
+        if r.status_code >= 500:
+            self._upload_failed(connection, 'HTTP {}'.format(r.status_code))
+            return
+        try:
+            r.raise_for_status()
+            responses = r.json()
+            if not isinstance(responses, list) or len(responses) != len(rows):
+                raise ValueError(
+                    'Expected a list of {} responses'.format(len(rows))
+                )
+        except (requests.exceptions.HTTPError, ValueError) as e:
+            self._upload_rejected(connection, rows, e)
+            return
+        METRICS.observe('journal_upload', monotonic() - start)
+        now = time.time()
+        with connection:
+            connection.executemany(
+                'UPDATE journal SET sent = ? WHERE id = ?',
+                [(now, row[0]) for row in rows]
+            )
+            connection.execute(
+                'DELETE FROM journal WHERE sent < ? OR failed < ?',
+                (now - self.retention, now - self.retention)
+            )
+        for row, response in zip(rows, responses):
+            self.queue.put((row[1], response))
+        self.sent += len(rows)
+        METRICS.increment('journal_sent', len(rows))
+        with self._condition:
+            self.failures = 0
+            self._retry_at = None
+            self._unsent -= len(rows)
+            self._isolate = max(self._isolate - len(rows), 0)
+            self._oldest = monotonic()
+
+    def _upload_failed(self, connection, error):
+        logger.info('Journal upload failed, {}'.format(error))
+        METRICS.increment('journal_upload_failed')
+        # Every unsent entry is delayed, not only this batch.
+        with connection:
+            delayed = connection.execute(
+                'SELECT qrcode FROM journal '
+                'WHERE sent IS NULL AND failed IS NULL AND attempts = 0'
+            ).fetchall()
+            connection.execute(
+                'UPDATE journal SET attempts = attempts + 1 '
+                'WHERE sent IS NULL AND failed IS NULL'
+            )
+        # Let the UI loop clear the active QR codes. They're still sent.
+        for qrcode, in delayed:
+            self.queue.put((qrcode, dict(network_timeout=True)))
+        self._retry_later()
+
+    def _upload_rejected(self, connection, rows, error):
+        logger.warning('Journal upload rejected, {}'.format(error))
+        METRICS.increment('journal_upload_rejected')
+        if len(rows) > 1:
+            # Find the bad entry, by sending each entry of the batch alone.
+            with self._condition:
+                self._isolate = len(rows)
+            return
+        entry_id, qrcode = rows[0][:2]
+        with connection:
+            connection.execute(
+                'UPDATE journal SET rejections = rejections + 1 '
+                'WHERE id = ?',
+                (entry_id, )
+            )
+            rejections = connection.execute(
+                'SELECT rejections FROM journal WHERE id = ?', (entry_id, )
+            ).fetchone()[0]
+            if rejections >= self.max_attempts:
+                connection.execute(
+                    'UPDATE journal SET failed = ? WHERE id = ?',
+                    (time.time(), entry_id)
+                )
+        if rejections < self.max_attempts:
+            self._retry_later()
+            return
+        logger.error('Dead lettered {}, after {} attempts'.format(
+            qrcode, rejections
+        ))
+        self.queue.put((qrcode, None))
+        self.dead += 1
+        METRICS.increment('journal_dead')
+        with self._condition:
+            self.failures = 0
+            self._retry_at = None
+            self._unsent -= 1
+            self._isolate = max(self._isolate - 1, 0)
+
+    def _retry_later(self):
+        with self._condition:
+            self.failures += 1
+            delay = self.backoff * (2 ** (self.failures - 1))
+            self._retry_at = monotonic() + min(delay, self.max_backoff)
+
+    def stop(self):
+        """Stop the uploader, after it writes submitted entries. Unsent
+        entries are replayed on the next start"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import deque
+from threading import Thread, Condition
+import requests
+from requests.adapters import HTTPAdapter
+from compat import monotonic
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class AuthWorkerPool(object):
+    """Auth against the server on a bounded pool of worker threads, which
+    share a keep alive requests.Session.
+
+    The submit queue is bounded. When it is full, new requests are dropped.
+    A QR code is never queued twice, as the scanner neither resends a QR
+    code with an auth in flight, nor one it has claimed.
+    """
+    def __init__(
+        self,
+        target,
+        queue,
+        url,
+        workers=2,
+        max_queue=8,
+        timeout=5,
+        retries=2,
+        backoff=0.5,
+        kwargs=None
+    ):
+        self.target = target
+        self.queue = queue
+        self.url = url
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        # Extra keyword arguments for the target, as with Thread.
+        self.kwargs = kwargs or {}
+        self.dropped = 0
+        # Reuse connections, one per worker.
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._jobs = deque()
+        self._stopped = False
+        self._condition = Condition()
+        self._threads = []
+        for i in range(workers):
+            thread = Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, qrcode, picture, timestamp):
+        """Queue a request, without blocking. Returns False if the request
+        was dropped"""
+        job = (qrcode, picture, timestamp, monotonic())
+        with self._condition:
+            if len(self._jobs) >= self.max_queue:
+                self.dropped += 1
+                METRICS.increment('auth_dropped')
+                logger.info('Auth queue full, dropped {}'.format(qrcode))
+                return False
+            self._jobs.append(job)
+            self._condition.notify()
+        return True
+
+    def pending(self):
+        """Number of queued requests"""
+        with self._condition:
+            return len(self._jobs)
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._jobs and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                qrcode, picture, timestamp, queued = self._jobs.popleft()
+            METRICS.observe('auth_queue_wait', monotonic() - queued)
+            try:
+                self.target(
+                    self.queue,
+                    self.url,
+                    qrcode,
+                    picture,
+                    timestamp,
+                    timeout=self.timeout,
+                    session=self.session,
+                    retries=self.retries,
+                    backoff=self.backoff,
+                    **self.kwargs
+                )
+            except Exception:
+                logger.exception('Auth failed for {}'.format(qrcode))
+                # Let the UI loop clear the active QR code.
+                self.queue.put((qrcode, None))
+
+    def stop(self):
+        """Stop the workers, after they finish the current request. Queued
+        requests are discarded"""
+        with self._condition:
+            self._stopped = True
+            self._jobs.clear()
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self.session.close()
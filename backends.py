@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+import numpy
+import cv2
+from threading import local
+
+
+def text(data):
+    """QR code data as text. Some decoders return bytes on Python 3"""
+    if not isinstance(data, str):
+        data = data.decode('utf-8', 'replace')
+    return data
+
+
+class ScanBackend(object):
+    """Decodes QR codes from a grayscale, uint8 frame.
+
+    Frames are handed to the decoder without intermediate copies, where the
+    decoder allows. Only the opencv backend does, zbar and pyzbar copy each
+    frame once. bytes_copied counts the bytes which had to be copied.
+
+    Scan workers are threads, so they only scan in parallel if the backend
+    releases the GIL while decoding, as releases_gil says.
+    """
+    name = None
+    releases_gil = False
+
+    def __init__(self):
+        self.bytes_copied = 0
+        self.frames = 0
+        self._local = local()
+
+    def contiguous(self, gray):
+        """Returns a C contiguous array, which only copies crops"""
+        if not gray.flags['C_CONTIGUOUS']:
+            self.bytes_copied += gray.nbytes
+            gray = numpy.ascontiguousarray(gray)
+        return gray
+
+    def image(self, gray):
+        """Returns the decoder's input for the frame"""
+        raise NotImplementedError
+
+    def decode(self, image):
+        """Returns a list of (data, location) tuples"""
+        raise NotImplementedError
+
+    def scan(self, gray):
+        """Returns a list of (data, location) tuples, with data as text,
+        whichever the backend"""
+        self.frames += 1
+        return [
+            (text(data), location)
+            for data, location in self.decode(self.image(gray))
+        ]
+
+
+class ZBarBackend(ScanBackend):
+    """The zbar binding only accepts str data, so the frame is copied once,
+    with ndarray.tobytes(). It holds the GIL while scanning"""
+    name = 'zbar'
+
+    def __init__(self):
+        super(ZBarBackend, self).__init__()
+        import zbar
+        self.zbar = zbar
+
+    @property
+    def scanner(self):
+        """ZBar image scanners aren't thread safe, so one per thread"""
+        scanner = getattr(self._local, 'scanner', None)
+        if scanner is None:
+            zbar = self.zbar
+            scanner = self._local.scanner = zbar.ImageScanner()
+            # Disable all zbar symbols.
+            scanner.set_config(0, zbar.Config.ENABLE, 0)
+            # Enable QRCodes.
+            scanner.set_config(zbar.Symbol.QRCODE, zbar.Config.ENABLE, 1)
+        return scanner
+
+    def image(self, gray):
+        height, width = gray.shape[:2]
+        data = gray.tobytes()
+        self.bytes_copied += len(data)
+        return self.zbar.Image(width, height, 'Y800', data)
+
+    def decode(self, image):
+        self.scanner.scan(image)
+        return [(symbol.data, list(symbol.location)) for symbol in image]
+
+
+class PyZBarBackend(ScanBackend):
+    """pyzbar copies the frame once, with ndarray.tobytes(). ctypes releases
+    the GIL while zbar scans"""
+    name = 'pyzbar'
+    releases_gil = True
+
+    def __init__(self):
+        super(PyZBarBackend, self).__init__()
+        from pyzbar import pyzbar
+        self.pyzbar = pyzbar
+
+    def image(self, gray):
+        gray = self.contiguous(gray)
+        self.bytes_copied += gray.nbytes
+        return gray
+
+    def decode(self, image):
+        symbols = self.pyzbar.decode(
+            image, symbols=[self.pyzbar.ZBarSymbol.QRCODE]
+        )
+        return [
+            (symbol.data, [(point.x, point.y) for point in symbol.polygon])
+            for symbol in symbols
+        ]
+
+
+class OpenCVBackend(ScanBackend):
+    """cv2.QRCodeDetector reads the NumPy array directly, and releases the
+    GIL while decoding"""
+    name = 'opencv'
+    releases_gil = True
+
+    @property
+    def detector(self):
+        """One detector per thread"""
+        detector = getattr(self._local, 'detector', None)
+        if detector is None:
+            detector = self._local.detector = cv2.QRCodeDetector()
+        return detector
+
+    def image(self, gray):
+        return gray
+
+    def decode(self, image):
+        detector = self.detector
+        results = []
+        if hasattr(detector, 'detectAndDecodeMulti'):
+            ok, datas, points, _ = detector.detectAndDecodeMulti(image)
+            if not ok:
+                return results
+        else:
+            # OpenCV < 4.3.0 only decodes one QR code.
+            data, points, _ = detector.detectAndDecode(image)
+            if points is None:
+                return results
+            datas, points = [data], points.reshape(1, -1, 2)
+        for data, location in zip(datas, points):
+            if data:
+                location = [(int(x), int(y)) for x, y in location]
+                results.append((data, location))
+        return results
+
+
+BACKENDS = dict(
+    (backend.name, backend)
+    for backend in (ZBarBackend, PyZBarBackend, OpenCVBackend)
+)
+
+
+def releases_gil(backend):
+    """Does the backend, or the backend by name, release the GIL?"""
+    if not isinstance(backend, ScanBackend):
+        backend = BACKENDS.get(backend or 'zbar', ScanBackend)
+    return backend.releases_gil
+
+
+def get_backend(name='zbar'):
+    """Returns a scan backend by name"""
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown scan backend {}'.format(name))
+    return backend()
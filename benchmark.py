@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import argparse
+import timeit
+import numpy
+import cv2
+from PIL import Image
+from compat import monotonic
+from backends import BACKENDS
+from qrcodescanner import QRCodeScanner
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2.7
+    tracemalloc = None
+
+RESOLUTIONS = {
+    '480p': (640, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+# Synthetic scenes, as (QR codes, fraction of frame height, degrees
+# rotation, blur kernel size, noise standard deviation).
+SCENES = {
+    'empty': (0, 0.0, 0, 0, 0),
+    'one': (1, 0.4, 0, 0, 0),
+    'small': (1, 0.15, 0, 0, 0),
+    'rotated': (1, 0.4, 30, 0, 0),
+    'blurred': (1, 0.4, 0, 5, 0),
+    'noisy': (1, 0.4, 0, 0, 12),
+    'many': (4, 0.25, 15, 3, 6),
+}
+
+
+def encode_qrcode(data):
+    """Returns a grayscale QR code, one pixel per module, with a quiet
+    zone. Requires OpenCV 4.5.3 or later, or else the qrcode package"""
+    if hasattr(cv2, 'QRCodeEncoder'):
+        encoder = cv2.QRCodeEncoder.create()
+        qrcode = encoder.encode(data)
+        return cv2.copyMakeBorder(
+            qrcode, 4, 4, 4, 4, cv2.BORDER_CONSTANT, value=255
+        )
+    import qrcode
+    matrix = qrcode.QRCode(border=4)
+    matrix.add_data(data)
+    matrix.make()
+    modules = numpy.array(matrix.get_matrix(), dtype=numpy.uint8)
+    return (1 - modules) * 255
+
+
+def synthetic_frame(resolution, scene, seed=0):
+    """Returns an RGB frame of the scene, and the data of its QR codes"""
+    count, size, angle, blur, noise = SCENES[scene]
+    width, height = resolution
+    random = numpy.random.RandomState(seed)
+    frame = numpy.full((height, width), 160, dtype=numpy.uint8)
+    datas = []
+    for index in range(count):
+        data = 'benchmark-{}-{}'.format(scene, index)
+        side = int(height * size)
+        qrcode = cv2.resize(
+            encode_qrcode(data), (side, side),
+            interpolation=cv2.INTER_NEAREST
+        )
+        if angle:
+            center = (side / 2.0, side / 2.0)
+            matrix = cv2.getRotationMatrix2D(center, angle, 1.0)
+            qrcode = cv2.warpAffine(
+                qrcode, matrix, (side, side), borderValue=255
+            )
+        # Place QR codes side by side, so they don't overlap.
+        slot = width // count
+        x = index * slot + random.randint(0, max(slot - side, 0) + 1)
+        y = random.randint(0, max(height - side, 0) + 1)
+        w, h = min(side, width - x), min(side, height - y)
+        frame[y:y + h, x:x + w] = qrcode[:h, :w]
+        datas.append(data)
+    if blur:
+        frame = cv2.GaussianBlur(frame, (blur, blur), 0)
+    if noise:
+        frame = numpy.clip(
+            frame + random.normal(0, noise, frame.shape), 0, 255
+        ).astype(numpy.uint8)
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB), datas
+
+
+def summarize(seconds):
+    """Throughput, and latency percentiles in milliseconds"""
+    seconds = numpy.array(seconds)
+    p50, p95, p99 = numpy.percentile(seconds, [50, 95, 99]) * 1000
+    return dict(
+        frames=len(seconds),
+        fps=len(seconds) / seconds.sum() if seconds.sum() else None,
+        p50_ms=p50,
+        p95_ms=p95,
+        p99_ms=p99
+    )
+
+
+def time_stage(func, number):
+    """Returns the seconds taken by each of number calls"""
+    seconds = []
+    for i in range(number):
+        start = monotonic()
+        func()
+        seconds.append(monotonic() - start)
+    return seconds
+
+
+def init_pygame(resolution):
+    """Returns a display surface, or None without pygame. Uses the dummy
+    video driver, so no screen is required"""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    try:
+        import pygame
+    except ImportError:
+        return None
+    pygame.display.init()
+    return pygame.display.set_mode(resolution)
+
+
+def benchmark_pipeline(
+    resolution,
+    scene,
+    number=100,
+    backend='zbar',
+    display_size=None
+):
+    """Times each pipeline stage in isolation, then end to end"""
+    width, height = RESOLUTIONS[resolution]
+    display_size = display_size or (width, height)
+    frame, datas = synthetic_frame((width, height), scene)
+    scanner = QRCodeScanner(backend=backend)
+    _, qrcodes = scanner.zbar(frame.copy())
+    locations = list(qrcodes.values())
+    resize_buffer = numpy.empty(
+        (display_size[1], display_size[0], 3), dtype=numpy.uint8
+    )
+    frame_buffer = numpy.empty_like(resize_buffer)
+    # Boxes are drawn onto a copy, so the frame scanned is always clean.
+    drawn = numpy.empty_like(frame)
+    surface = init_pygame(display_size)
+
+    def zbar():
+        scanner.zbar(frame)
+
+    def draw_box():
+        # Includes the copy, which the render loop doesn't make.
+        numpy.copyto(drawn, frame)
+        for location in locations:
+            scanner.draw_box(drawn, location, scanner.ok_color, 2)
+
+    def resize():
+        cv2.resize(drawn, display_size, dst=resize_buffer)
+
+    def flip():
+        cv2.flip(resize_buffer, 1, dst=frame_buffer)
+
+    stages = dict(zbar=zbar, draw_box=draw_box, resize=resize, flip=flip)
+    if surface is not None:
+        import pygame
+        frame_surface = pygame.image.frombuffer(
+            frame_buffer, display_size, 'RGB'
+        )
+
+        def blit():
+            surface.blit(frame_surface, (0, 0))
+
+        stages['blit'] = blit
+
+    def end_to_end():
+        for stage in ('zbar', 'draw_box', 'resize', 'flip', 'blit'):
+            if stage in stages:
+                stages[stage]()
+
+    results = dict(
+        (name, summarize(time_stage(stage, number)))
+        for name, stage in stages.items()
+    )
+    results['end_to_end'] = summarize(time_stage(end_to_end, number))
+    results['decoded'] = len(set(datas) & set(qrcodes))
+    results['expected'] = len(datas)
+    return results
+
+
+def pil_handoff(threshold):
+    """The previous handoff to ZBar, by way of a PIL image"""
+    pil_image = Image.fromarray(threshold)
+    width, height = pil_image.size
+    tobytes = getattr(pil_image, 'tobytes', None) or pil_image.tostring
+    return width, height, tobytes()
+
+
+def bytes_allocated(func, *args):
+    """Bytes allocated while calling func, as traced by tracemalloc"""
+    if tracemalloc is None:
+        return None
+    tracemalloc.start()
+    try:
+        result = func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak
+
+
+def benchmark_handoff(resolution, number=100):
+    """Bytes copied or allocated, and seconds per frame, handing a frame
+    to the decoder"""
+    width, height = RESOLUTIONS[resolution]
+    threshold = numpy.random.randint(
+        0, 2, (height, width)
+    ).astype(numpy.uint8) * 255
+    results = dict(
+        pil=dict(
+            bytes_allocated=bytes_allocated(pil_handoff, threshold),
+            seconds=timeit.timeit(
+                lambda: pil_handoff(threshold), number=number
+            ) / number
+        )
+    )
+    for name in sorted(BACKENDS):
+        try:
+            backend = BACKENDS[name]()
+        except ImportError:
+            continue
+        backend.image(threshold)
+        results[name] = dict(
+            bytes_copied=backend.bytes_copied,
+            bytes_allocated=bytes_allocated(backend.image, threshold),
+            seconds=timeit.timeit(
+                lambda: backend.image(threshold), number=number
+            ) / number
+        )
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='QR Code Scanner Benchmark')
+    parser.add_argument(
+        '--resolution',
+        dest='resolutions',
+        action='store',
+        choices=sorted(RESOLUTIONS),
+        nargs='+',
+        default=sorted(RESOLUTIONS)
+    )
+    parser.add_argument(
+        '--scene',
+        dest='scenes',
+        action='store',
+        choices=sorted(SCENES),
+        nargs='+',
+        default=sorted(SCENES)
+    )
+    parser.add_argument(
+        '--scan-backend',
+        dest='scan_backend',
+        action='store',
+        choices=sorted(BACKENDS),
+        default='zbar'
+    )
+    parser.add_argument(
+        '--number',
+        dest='number',
+        action='store',
+        type=int,
+        default=100
+    )
+    args = parser.parse_args()
+
+    report = dict(
+        handoff=dict(
+            (resolution, benchmark_handoff(resolution, args.number))
+            for resolution in args.resolutions
+        ),
+        pipeline=dict(
+            (resolution, dict(
+                (scene, benchmark_pipeline(
+                    resolution,
+                    scene,
+                    number=args.number,
+                    backend=args.scan_backend
+                ))
+                for scene in args.scenes
+            ))
+            for resolution in args.resolutions
+        )
+    )
+    json.dump(report, sys.stdout, indent=2, sort_keys=True)
+    sys.stdout.write('\n')
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import cv2
+from threading import Lock
+
+
+def raw_gray(gray):
+    """No binarization"""
+    return gray
+
+
+def otsu(gray):
+    """Apply Otsu Binarization"""
+    _, threshold = cv2.threshold(
+        gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+    )
+    return threshold
+
+
+def adaptive_gaussian(gray, block_size=31, c=10):
+    """Threshold against a Gaussian weighted sum of the neighborhood, which
+    copes with uneven lighting"""
+    return cv2.adaptiveThreshold(
+        gray,
+        255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY,
+        block_size,
+        c
+    )
+
+
+def clahe_otsu(gray, clip_limit=2.0, tile_grid_size=(8, 8)):
+    """Equalize contrast locally with CLAHE, then apply Otsu Binarization"""
+    clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+    return otsu(clahe.apply(gray))
+
+
+STRATEGIES = {
+    'gray': raw_gray,
+    'otsu': otsu,
+    'adaptive': adaptive_gaussian,
+    'clahe': clahe_otsu,
+}
+
+
+class Strategy(object):
+    """A binarization strategy, with attempt, hit and latency counters"""
+    def __init__(self, name, func, decay=0.1):
+        self.name = name
+        self.func = func
+        self.decay = decay
+        self.attempts = 0
+        self.hits = 0
+        self.seconds = 0.0
+        # Exponential moving average of the success rate, so the ranking
+        # follows recent traffic.
+        self.success_rate = 0.0
+
+    def __call__(self, gray):
+        return self.func(gray)
+
+    @property
+    def latency(self):
+        """Average seconds per attempt, including the scan"""
+        return self.seconds / self.attempts if self.attempts else 0.0
+
+    def record(self, hit, seconds):
+        self.attempts += 1
+        self.hits += 1 if hit else 0
+        self.seconds += seconds
+        result = 1.0 if hit else 0.0
+        self.success_rate += self.decay * (result - self.success_rate)
+
+
+class Binarizer(object):
+    """Ranks binarization strategies by recent success rate. Ties keep the
+    configured order.
+
+    Most frames have no QR code, and every strategy fails on those, so at
+    most max_strategies are tried per frame. The best, then the others in
+    turn, so their success rates are still kept up to date.
+    """
+    def __init__(self, strategies=('otsu', ), decay=0.1, max_strategies=2):
+        self.max_strategies = max_strategies
+        self.strategies = []
+        for name in strategies:
+            try:
+                func = STRATEGIES[name]
+            except KeyError:
+                raise ValueError('Unknown binarization strategy {}'.format(
+                    name
+                ))
+            self.strategies.append(Strategy(name, func, decay=decay))
+        self.lock = Lock()
+        # Which of the other strategies is tried next.
+        self._turn = 0
+
+    def ranked(self):
+        """Strategies, best first"""
+        with self.lock:
+            return sorted(
+                self.strategies,
+                key=lambda strategy: strategy.success_rate,
+                reverse=True
+            )
+
+    def select(self):
+        """Strategies to try on the next frame, best first"""
+        ranked = self.ranked()
+        if not self.max_strategies or len(ranked) <= self.max_strategies:
+            return ranked
+        best = ranked[0]
+        others = [s for s in self.strategies if s is not best]
+        with self.lock:
+            turn = self._turn
+            self._turn += 1
+        return [best] + [
+            others[(turn + i) % len(others)]
+            for i in range(self.max_strategies - 1)
+        ]
+
+    def record(self, strategy, hit, seconds):
+        with self.lock:
+            strategy.record(hit, seconds)
+
+    def stats(self):
+        """Per strategy attempts, hits, and latency"""
+        with self.lock:
+            return dict(
+                (strategy.name, dict(
+                    attempts=strategy.attempts,
+                    hits=strategy.hits,
+                    latency=strategy.latency,
+                    success_rate=strategy.success_rate
+                ))
+                for strategy in self.strategies
+            )
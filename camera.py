@@ -1,39 +1,136 @@
 # -*- coding: utf-8 -*-
+import os
+import logging
 import numpy as np
 import cv2
+from threading import Thread, Lock, Event
+from compat import monotonic
+from captureconfig import CaptureConfig, configure, negotiate
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
 
 SIXTEEN_BY_TEN = round(16 / 10.0, 2)
 SIXTEEN_BY_NINE = round(16 / 9.0, 2)
 FOUR_BY_THREE = round(4 / 3.0, 2)
+IMAGE_EXTENSIONS = ('.bmp', '.jpeg', '.jpg', '.png', '.tif', '.tiff')
+# Where the driver buffer can't be bounded, drain at most this many frames.
+MAX_DRAIN = 4
+# Driver timestamps older than this are assumed to be on another clock.
+MAX_SENSOR_AGE = 5.0
+
 
+def sensor_time(capture, grabbed):
+    """When the frame was captured. V4L2 timestamps buffers on the monotonic
+    clock, otherwise when grab() returned"""
+    captured = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+    if captured > 0 and 0 <= grabbed - captured < MAX_SENSOR_AGE:
+        return captured
+    return grabbed
 
-def video_capture(resolution):
+
+def video_capture(resolution, device=0):
+    """VideoCapture, on Windows, has no format or FPS to choose"""
     try:
         import VideoCapture
     except ImportError:
         pass
     else:
-        capture = VideoCapture.Device()
+        capture = VideoCapture.Device(devnum=device)
         capture.setResolution(int(resolution[0]), int(resolution[1]))
         return VideoCaptureManager(capture, resolution)
 
 
-def cv2_capture(resolution):
-    capture = cv2.VideoCapture(0)
-    capture.set(3, resolution[0])  # CV_CAP_PROP_FRAME_WIDTH
-    capture.set(4, resolution[1])  # CV_CAP_PROP_FRAME_HEIGHT
-    capture.set(5, 30)  # CV_CAP_PROP_FPS
+def cv2_capture(
+        resolution,
+        device=0,
+        yuyv=False,
+        fps=30,
+        fourcc=None,
+        negotiate_format=False,
+        buffer_size=1):
+    """Device is a camera index, or a video file or stream.
+
+    With yuyv, the camera's YUYV frames are kept as they are, so the luma
+    plane can be scanned without any color conversion. Otherwise, the
+    format is fourcc, if given, or with negotiate_format, whichever format
+    delivers the most FPS.
+
+    Frames queued by the driver are late, so its buffer is bounded to
+    buffer_size. If that isn't possible, stale frames from camera indexes
+    are drained instead.
+    """
+    capture = cv2.VideoCapture(device)
+    if yuyv:
+        fourcc = 'YUYV'
+    if fourcc is None and negotiate_format:
+        config = negotiate(capture, resolution, fps=fps)
+    else:
+        config = configure(capture, resolution, fps=fps, fourcc=fourcc)
+    if yuyv and config.fourcc != 'YUYV':
+        # Otherwise, frames would be left compressed, for example as MJPG.
+        logger.warning(
+            'Capture {} is not YUYV, so converting frames'.format(config)
+        )
+        yuyv = False
+    if yuyv:
+        # Not every backend can skip conversion, so check that it did.
+        yuyv = capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    bounded = capture.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+    logger.info('Capture {}, buffer {}'.format(
+        config, buffer_size if bounded else 'unbounded'
+    ))
     # OpenCV considers the previously set resolution as a suggestion.
-    current_resolution = int(capture.get(3)), int(capture.get(4))
-    return CV2CaptureManager(capture, current_resolution)
+    camera = CV2CaptureManager(
+        capture, (config.width, config.height), yuyv=yuyv
+    )
+    camera.config = config
+    # Only cameras queue frames. Frames from files are grabbed instantly,
+    # so draining would skip most of them.
+    if not bounded and isinstance(device, int):
+        camera.drain = MAX_DRAIN
+    return camera
+
+
+def video_file_capture(path, loop=False):
+    """Frames from a video file, in order, without dropping any"""
+    capture = cv2.VideoCapture(path)
+    resolution = (
+        int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    )
+    return VideoFileCaptureManager(capture, resolution, loop=loop)
+
+
+def image_directory_capture(path, loop=False):
+    """Frames from the images in a directory, in filename order"""
+    paths = [
+        os.path.join(path, filename)
+        for filename in sorted(os.listdir(path))
+        if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
+    ]
+    return ImageDirectoryCaptureManager(paths, loop=loop)
 
 
 class CaptureManager(object):
+    # Frames are read from storage, rather than captured live, so none
+    # need be dropped to keep up.
+    offline = False
+
     def __init__(self, capture, resolution):
         self.capture = capture
         self.resolution = resolution
         self.entered_frame = False
+        # Whether a finite source, such as a video file, has run out.
+        self.exhausted = False
+        # The negotiated format, resolution and FPS, if known.
+        self.config = CaptureConfig(None, resolution[0], resolution[1], None)
+        # When the current frame was captured, on the monotonic clock.
+        self.frame_time = None
+        # Extra frames grab() may drop, to skip frames queued by the driver.
+        self.drain = 0
         self._frame = None
+        self._gray = None
         self._channel = 0
 
     @property
@@ -45,6 +142,22 @@ class CaptureManager(object):
         if self._channel != value:
             self._channel = value
             self._frame = None
+            self._gray = None
+
+    @property
+    def rgb(self):
+        """The frame, as RGB, for display"""
+        return self.frame
+
+    @property
+    def gray(self):
+        """The frame, as grayscale, for scanning"""
+        if self._gray is None:
+            frame = self.frame
+            if frame is not None:
+                with METRICS.timer('color_conversion'):
+                    self._gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        return self._gray
 
     def enter_frame(self):
         pass
@@ -54,13 +167,55 @@ class CaptureManager(object):
 
 
 class CV2CaptureManager(CaptureManager):
+    """Frames are retrieved, and converted, only when they are asked for.
+
+    The raw frame is BGR, or YUYV if the camera was opened that way.
+    Both the RGB and grayscale views are converted from it, at most once
+    per frame, so a frame that is only scanned is never converted to RGB.
+    """
+    def __init__(self, capture, resolution, yuyv=False):
+        super(CV2CaptureManager, self).__init__(capture, resolution)
+        self.yuyv = yuyv
+        self._raw = None
+
+    @property
+    def raw(self):
+        if self.entered_frame and self._raw is None:
+            with METRICS.timer('retrieve'):
+                _, self._raw = self.capture.retrieve()
+            if self.yuyv and self._raw is not None:
+                # Some backends return YUYV as a flat buffer.
+                width, height = self.resolution
+                self._raw = self._raw.reshape(height, width, 2)
+        return self._raw
+
     @property
     def frame(self):
-        if self.entered_frame and self._frame is None:
-            _, frame = self.capture.retrieve()
-            self._frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        if self._frame is None:
+            raw = self.raw
+            if raw is not None:
+                with METRICS.timer('color_conversion'):
+                    if self.yuyv:
+                        code = cv2.COLOR_YUV2RGB_YUYV
+                    else:
+                        code = cv2.COLOR_BGR2RGB
+                    self._frame = cv2.cvtColor(raw, code)
         return self._frame
 
+    @property
+    def gray(self):
+        if self._gray is None:
+            raw = self.raw
+            if raw is None:
+                pass
+            elif self.yuyv:
+                # The luma plane, as is. A view, so nothing is copied.
+                self._gray = raw[:, :, 0]
+            else:
+                with METRICS.timer('color_conversion'):
+                    self._gray = cv2.cvtColor(raw, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
     def enter_frame(self):
         """Capture the next frame, if any."""
         # But first, check that any previous frame was exited.
@@ -68,16 +223,180 @@ class CV2CaptureManager(CaptureManager):
             'previous enter_frame() had no matching exit_frame()'
 
         if self.capture is not None:
-            self.entered_frame = self.capture.grab()
+            with METRICS.timer('grab'):
+                self.entered_frame = self.grab()
+            if self.entered_frame:
+                self.frame_time = sensor_time(self.capture, monotonic())
+
+    def grab(self):
+        """Grab the newest frame. Frames queued by the driver are grabbed
+        without waiting for the camera, so grab again while that's so, up
+        to drain frames"""
+        fps = self.config.fps or 30
+        started = monotonic()
+        grabbed = self.capture.grab()
+        drained = 0
+        while grabbed and drained < self.drain:
+            if monotonic() - started >= 0.25 / fps:
+                break
+            started = monotonic()
+            grabbed = self.capture.grab()
+            drained += 1
+        if drained:
+            METRICS.increment('drained_frames', drained)
+        return grabbed
 
     def exit_frame(self):
         """Release the frame."""
-        # Check whether any grabbed frame is retrievable.
-        # The getter may retrieve and cache the frame.
-        if self.frame is None:
-            self.entered_frame = False
-            return
+        self._raw = None
+        self._frame = None
+        self._gray = None
+        self.entered_frame = False
+
+
+class ThreadedCV2CaptureManager(CV2CaptureManager):
+    """Grab and retrieve frames on a dedicated thread.
+
+    The newest frame is handed off through a one slot buffer. If the render
+    loop hasn't taken a frame before the next one is captured, the older
+    frame is dropped. Frames that are dropped are never converted.
+    """
+    def __init__(self, capture, resolution, yuyv=False):
+        super(ThreadedCV2CaptureManager, self).__init__(
+            capture, resolution, yuyv=yuyv
+        )
+        self.dropped_frames = 0
+        self.captured_frames = 0
+        # Seconds from grab() until the frame was taken by enter_frame().
+        self.latency = 0.0
+        self.max_latency = 0.0
+        self._slot = None
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = Thread(target=self._capture_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def raw(self):
+        return self._raw
 
-        # Release the frame.
+    def _capture_loop(self):
+        # Frames are grabbed as soon as they're ready, so none are left
+        # queued in the driver buffer, and needn't be drained.
+        while not self._stopped.is_set():
+            timestamp = monotonic()
+            if not self.capture.grab():
+                # Camera stalled, or was disconnected.
+                self._stopped.wait(0.01)
+                continue
+            retrieved = monotonic()
+            METRICS.observe('grab', retrieved - timestamp)
+            frame_time = sensor_time(self.capture, retrieved)
+            _, frame = self.capture.retrieve()
+            if frame is None:
+                continue
+            METRICS.observe('retrieve', monotonic() - retrieved)
+            if self.yuyv:
+                width, height = self.resolution
+                frame = frame.reshape(height, width, 2)
+            with self._lock:
+                if self._slot is not None:
+                    self.dropped_frames += 1
+                    METRICS.increment('dropped_frames')
+                self._slot = (frame, timestamp, frame_time)
+                self.captured_frames += 1
+
+    def enter_frame(self):
+        """Take the newest frame, if any. Never blocks on the camera."""
+        assert not self.entered_frame, \
+            'previous enter_frame() had no matching exit_frame()'
+
+        with self._lock:
+            slot, self._slot = self._slot, None
+        if slot is not None:
+            self._raw, timestamp, self.frame_time = slot
+            self.latency = monotonic() - timestamp
+            METRICS.observe('capture_latency', self.latency)
+            self.max_latency = max(self.max_latency, self.latency)
+            self.entered_frame = True
+
+    def release(self):
+        """Stop the capture thread, and release the camera."""
+        self._stopped.set()
+        self._thread.join()
+        self.capture.release()
+
+
+class VideoFileCaptureManager(CV2CaptureManager):
+    offline = True
+
+    def __init__(self, capture, resolution, loop=False):
+        super(VideoFileCaptureManager, self).__init__(capture, resolution)
+        self.loop = loop
+
+    def enter_frame(self):
+        """Capture the next frame. At the end of the file, rewind if looping,
+        or else the capture is exhausted"""
+        super(VideoFileCaptureManager, self).enter_frame()
+        if not self.entered_frame:
+            if self.loop:
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.entered_frame = self.capture.grab()
+            else:
+                self.exhausted = True
+
+
+class FrameArrayCaptureManager(CaptureManager):
+    """Frames from an in-memory sequence of RGB arrays"""
+    offline = True
+
+    def __init__(self, frames, loop=False):
+        self.frames = frames
+        self.loop = loop
+        self.index = 0
+        # The resolution of the first frame that loads, if any.
+        width, height = 0, 0
+        for item in frames:
+            frame = self.load(item)
+            if frame is not None:
+                height, width = frame.shape[:2]
+                break
+        super(FrameArrayCaptureManager, self).__init__(None, (width, height))
+
+    @property
+    def frame(self):
+        return self._frame
+
+    def load(self, item):
+        return item
+
+    def enter_frame(self):
+        """Take the next frame, if any"""
+        assert not self.entered_frame, \
+            'previous enter_frame() had no matching exit_frame()'
+
+        if self.index >= len(self.frames):
+            if not self.loop or not len(self.frames):
+                self.exhausted = True
+                return
+            self.index = 0
+        self._frame = self.load(self.frames[self.index])
+        self.frame_time = monotonic()
+        self.index += 1
+        self.entered_frame = self._frame is not None
+
+    def exit_frame(self):
+        """Release the frame."""
         self._frame = None
+        self._gray = None
         self.entered_frame = False
+
+
+class ImageDirectoryCaptureManager(FrameArrayCaptureManager):
+    """Frames from image files, loaded as they are entered"""
+    def load(self, path):
+        frame = cv2.imread(path)
+        if frame is not None:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        return frame
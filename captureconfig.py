@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import namedtuple
+import cv2
+from compat import monotonic
+
+logger = logging.getLogger(__name__)
+
+# In order of preference, if both deliver the requested FPS. YUYV needn't
+# be decoded, but at higher resolutions USB 2.0 bandwidth limits its FPS.
+FOURCCS = ('YUYV', 'MJPG')
+
+CaptureConfig = namedtuple(
+    'CaptureConfig', ['fourcc', 'width', 'height', 'fps']
+)
+
+
+def fourcc_code(name):
+    return cv2.VideoWriter_fourcc(*name)
+
+
+def fourcc_name(code):
+    code = int(code)
+    return ''.join(chr((code >> 8 * i) & 0xFF) for i in range(4))
+
+
+def configure(capture, resolution, fps=30, fourcc=None):
+    """Set the format first, as drivers reset the resolution and FPS when
+    it changes. Returns the configuration actually in effect, as drivers
+    consider what's set as a suggestion"""
+    if fourcc is not None:
+        capture.set(cv2.CAP_PROP_FOURCC, fourcc_code(fourcc))
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, resolution[0])
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, resolution[1])
+    capture.set(cv2.CAP_PROP_FPS, fps)
+    return current_config(capture)
+
+
+def current_config(capture):
+    return CaptureConfig(
+        fourcc=fourcc_name(capture.get(cv2.CAP_PROP_FOURCC)),
+        width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        fps=capture.get(cv2.CAP_PROP_FPS)
+    )
+
+
+def measure_fps(capture, frames=15, warmup=5, clock=monotonic):
+    """The FPS the device really delivers. The first frames after a format
+    change are often slow, so they aren't counted"""
+    for i in range(warmup):
+        if not capture.grab():
+            return 0.0
+    started = clock()
+    for i in range(frames):
+        if not capture.grab():
+            return 0.0
+    elapsed = clock() - started
+    return frames / elapsed if elapsed > 0 else float(frames)
+
+
+def negotiate(capture, resolution, fps=30, fourccs=FOURCCS, frames=15):
+    """Try each format, and keep the one that delivers the most FPS, up to
+    fps, at the requested resolution. Formats within 10% of each other are
+    considered equal, and the first is preferred"""
+    best, best_score = None, None
+    for fourcc in fourccs:
+        config = configure(capture, resolution, fps, fourcc=fourcc)
+        if config.fourcc != fourcc:
+            # Not supported by the device.
+            continue
+        measured = measure_fps(capture, frames=frames)
+        logger.info('Capture {} delivers {:.1f} FPS'.format(config, measured))
+        score = (
+            (config.width, config.height) == tuple(resolution),
+            round(min(measured, fps) / float(fps), 1)
+        )
+        if best_score is None or score > best_score:
+            best, best_score = config, score
+    if best is None:
+        # Let the driver choose.
+        return configure(capture, resolution, fps)
+    return configure(capture, resolution, fps, fourcc=best.fourcc)
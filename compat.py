@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+try:
+    from time import monotonic
+except ImportError:
+    # Python 2.7
+    from time import time as monotonic
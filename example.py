@@ -4,6 +4,8 @@ import argparse
 import traceback
 import logging
 from pygamewindow import PygameWindow
+from multicamera import MultiCameraWindow
+from options import add_scanner_arguments, start_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -18,21 +20,32 @@ if __name__ == '__main__':
         default=30.0
     )
     parser.add_argument(
-        '--width',
-        dest='width',
+        '--scan-fps',
+        dest='scan_fps',
         action='store',
-        type=int,
-        default=640
+        type=float,
+        default=0,
+        help='Scan rate, or 0 to scan every frame'
+    )
+    parser.add_argument(
+        '--adaptive-scan', dest='adaptive_scan', action='store_true'
     )
     parser.add_argument(
-        '--height',
-        dest='height',
+        '--device',
+        dest='devices',
         action='store',
-        type=int,
-        default=480
+        nargs='+',
+        default=['0'],
+        help='Camera indexes, or video files. More than one tiles the preview'
+    )
+    parser.add_argument(
+        '--startup-cache',
+        dest='startup_cache',
+        action='store',
+        help='Cache the negotiated camera and display configuration here'
     )
     parser.add_argument('--fullscreen', dest='fullscreen', action='store_true')
-    parser.add_argument('--debug', dest='debug', action='store_true')
+    add_scanner_arguments(parser)
     args = parser.parse_args()
 
     # Must configure logging before instantiating PygameWindow.
@@ -42,12 +55,49 @@ if __name__ == '__main__':
         error_log = 'error.log'
         logging.basicConfig(filename=error_log, level=logging.ERROR)
 
-    qrcode_scanner = PygameWindow(
+    devices = [int(d) if d.isdigit() else d for d in args.devices]
+    if len(devices) > 1:
+        window = MultiCameraWindow
+        # By default, each camera captures on its own thread, but video
+        # files don't, so no frame is dropped.
+        kwargs = dict(
+            devices=devices,
+            threaded_capture=args.threaded_capture,
+            yuyv=args.yuyv
+        )
+    else:
+        window = PygameWindow
+        kwargs = dict(
+            device=devices[0],
+            threaded_capture=args.threaded_capture,
+            yuyv=args.yuyv
+        )
+
+    start_metrics(args)
+
+    qrcode_scanner = window(
         name='QR Code Scanner',
+        url=args.url,
         fps=args.fps,
+        scan_fps=args.scan_fps,
+        adaptive_scan=args.adaptive_scan,
         resolution=(args.width, args.height),
         fullscreen=args.fullscreen,
+        scan_workers=args.scan_workers,
+        track_qrcodes=args.track_qrcodes,
+        scan_pyramid=args.scan_pyramid,
+        scan_backend=args.scan_backend,
+        binarization=args.binarization,
+        motion_threshold=args.motion_threshold,
+        throttle_db=args.throttle_db,
+        startup_cache=args.startup_cache,
+        clip_dir=args.clip_dir,
+        journal=args.journal,
+        journal_batch_size=args.journal_batch_size,
+        journal_linger=args.journal_linger,
+        negotiate_format=args.negotiate_format,
         debug=args.debug,
+        **kwargs
     )
 
     if not args.debug:
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import logging
+from collections import deque, namedtuple
+from threading import Thread, Lock
+try:
+    from Queue import Queue, Full, Empty
+except ImportError:
+    # Python 3
+    from queue import Queue, Full, Empty
+import cv2
+from compat import monotonic
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+Clip = namedtuple('Clip', ['qrcode', 'timestamp', 'until', 'frames'])
+
+
+def write_clip(directory):
+    """Returns a callback, which writes each clip to the directory as
+    Motion JPEG, which is simply the JPEG frames concatenated. The
+    directory is created, if need be"""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    def write(qrcode, timestamp, frames):
+        if not isinstance(qrcode, bytes):
+            qrcode = qrcode.encode('utf-8')
+        digest = hashlib.sha1(qrcode).hexdigest()[:8]
+        filename = '{}-{}.mjpeg'.format(
+            timestamp.strftime('%Y%m%d%H%M%S%f'), digest
+        )
+        with open(os.path.join(directory, filename), 'wb') as f:
+            for jpeg in frames:
+                f.write(jpeg)
+    return write
+
+
+class FrameRing(object):
+    """Recent frames, kept as evidence for auths.
+
+    Frames are sampled at fps, downscaled, then JPEG encoded on a
+    background thread, so the render loop only resizes. Encoded frames are
+    kept for before seconds, up to max_bytes in total.
+
+    trigger() snapshots the ring, which only copies references to encoded
+    frames, then collects frames for after seconds more. Each clip is
+    passed to callback, on the background thread. At most max_clips are
+    collected at once, so memory is bounded however busy the scanner is.
+    """
+    def __init__(
+        self,
+        callback,
+        before=2.0,
+        after=1.0,
+        fps=5.0,
+        scale=0.25,
+        quality=60,
+        max_bytes=4 * 1024 * 1024,
+        max_clips=4,
+        clock=monotonic
+    ):
+        self.callback = callback
+        self.before = before
+        self.after = after
+        self.interval = 1.0 / fps
+        self.scale = scale
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.max_clips = max_clips
+        self.clock = clock
+        self.size = 0
+        self.dropped_frames = 0
+        self.dropped_clips = 0
+        # Pairs of (time, jpeg), oldest first.
+        self._frames = deque()
+        self._clips = []
+        self._sampled_at = None
+        self._lock = Lock()
+        self._queue = Queue(maxsize=2)
+        self._thread = Thread(target=self._encode_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, frame):
+        """Sample the RGB frame, if it's time to. Never blocks"""
+        now = self.clock()
+        if self._sampled_at is not None:
+            if now - self._sampled_at < self.interval:
+                return
+        self._sampled_at = now
+        if self.scale != 1.0:
+            # Also copies the frame, which is drawn onto after scanning.
+            frame = cv2.resize(
+                frame,
+                None,
+                fx=self.scale,
+                fy=self.scale,
+                interpolation=cv2.INTER_AREA
+            )
+        else:
+            frame = frame.copy()
+        try:
+            self._queue.put_nowait((now, frame))
+        except Full:
+            self.dropped_frames += 1
+            METRICS.increment('ring_dropped_frames')
+
+    def trigger(self, qrcode, timestamp):
+        """Start a clip of the frames before, and after, now. Returns False
+        if too many clips are already being collected"""
+        with self._lock:
+            if len(self._clips) >= self.max_clips:
+                self.dropped_clips += 1
+                METRICS.increment('ring_dropped_clips')
+                return False
+            frames = [jpeg for _, jpeg in self._frames]
+            until = self.clock() + self.after
+            self._clips.append(Clip(qrcode, timestamp, until, frames))
+        return True
+
+    def _encode_loop(self):
+        while True:
+            try:
+                # At least a frame interval, so after=0 doesn't spin.
+                item = self._queue.get(
+                    timeout=max(self.after, self.interval)
+                )
+            except Empty:
+                # No frames, but clips must still finish.
+                item = (self.clock(), None)
+            if item is None:
+                return
+            now, frame = item
+            jpeg = None
+            if frame is not None:
+                jpeg = self.encode(frame)
+            with self._lock:
+                if jpeg is not None:
+                    self._append(now, jpeg)
+                finished = []
+                for clip in list(self._clips):
+                    if clip.until <= now:
+                        self._clips.remove(clip)
+                        finished.append(clip)
+                    elif jpeg is not None:
+                        clip.frames.append(jpeg)
+            for clip in finished:
+                try:
+                    self.callback(clip.qrcode, clip.timestamp, clip.frames)
+                except Exception:
+                    logger.exception('Clip failed for {}'.format(clip.qrcode))
+
+    def encode(self, frame):
+        frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        ok, buf = cv2.imencode(
+            '.jpeg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        )
+        return buf.tobytes() if ok else None
+
+    def _append(self, now, jpeg):
+        self._frames.append((now, jpeg))
+        self.size += len(jpeg)
+        while self._frames and (
+            self.size > self.max_bytes or
+            now - self._frames[0][0] > self.before
+        ):
+            _, oldest = self._frames.popleft()
+            self.size -= len(oldest)
+
+    def stop(self):
+        """Stop the background thread. Clips still being collected are
+        discarded"""
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import datetime
+import argparse
+import logging
+from camera import (
+    cv2_capture, video_file_capture, image_directory_capture,
+    ThreadedCV2CaptureManager
+)
+from options import add_scanner_arguments, start_metrics
+from pacing import FramePacer
+from qrcodescanner import QRCodeScanner
+
+logger = logging.getLogger(__name__)
+
+
+def json_lines(stream=sys.stdout):
+    """Returns a callback, which writes each event as a JSON line"""
+    def callback(event):
+        stream.write(json.dumps(event, sort_keys=True))
+        stream.write('\n')
+        stream.flush()
+    return callback
+
+
+class HeadlessScanner(object):
+    """Scans without pygame, for scanners without a screen.
+
+    Drives a capture manager and a QR code scanner only. Each QR code is
+    emitted to the callback when it appears, as a dict. With fps=0, the
+    loop runs uncapped.
+
+    Offline sources, such as video files, are scanned frame by frame, even
+    with scan workers, so no frame is dropped, and the last frame's result
+    is emitted before the source is exhausted.
+    """
+    def __init__(self, camera, scanner, callback=None, fps=0):
+        self.camera = camera
+        self.scanner = scanner
+        self.callback = callback or json_lines()
+        self.fps = fps
+        self.frames = 0
+        self.previous_qrcodes = {}
+        self.is_active = True
+
+    def emit(self, qrcodes, timestamp):
+        """Emit QR codes which weren't in the previous result"""
+        for qrcode in qrcodes:
+            if qrcode not in self.previous_qrcodes:
+                self.callback(dict(
+                    qrcode=qrcode,
+                    location=qrcodes[qrcode],
+                    timestamp=timestamp.isoformat()
+                ))
+        self.previous_qrcodes = qrcodes
+
+    def main(self):
+        timestamp = datetime.datetime.now()
+        self.camera.enter_frame()
+        gray = self.camera.gray
+        if gray is not None and gray.size:
+            # Nothing is displayed, so RGB is only needed for auth pictures.
+            frame = self.camera.rgb if self.scanner.url else None
+            self.scanner.record_frame(frame)
+            _, qrcodes = self.scanner.scan_frame(
+                frame,
+                timestamp,
+                gray=gray,
+                captured=self.camera.frame_time,
+                wait=self.camera.offline
+            )
+            self.emit(qrcodes, self.scanner.qrcodes_timestamp)
+            self.scanner.process_results_from_queue(timestamp)
+            self.frames += 1
+        self.camera.exit_frame()
+
+    def stop(self):
+        self.is_active = False
+
+    def run(self):
+        pacer = FramePacer(self.fps)
+        while self.is_active and not self.camera.exhausted:
+            self.main()
+            pacer.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Headless QR Code Scanner')
+    parser.add_argument(
+        '--fps',
+        dest='fps',
+        action='store',
+        type=float,
+        default=0,
+        help='Target rate, or 0 for uncapped'
+    )
+    parser.add_argument(
+        '--device',
+        dest='device',
+        action='store',
+        default='0',
+        help='Camera index, video file, or directory of images'
+    )
+    add_scanner_arguments(parser)
+    args = parser.parse_args()
+
+    # JSON lines go to stdout, so log to stderr.
+    level = logging.DEBUG if args.debug else logging.ERROR
+    logging.basicConfig(stream=sys.stderr, level=level)
+
+    start_metrics(args)
+
+    if os.path.isdir(args.device):
+        camera = image_directory_capture(args.device)
+    elif os.path.isfile(args.device):
+        camera = video_file_capture(args.device)
+    else:
+        device = int(args.device) if args.device.isdigit() else args.device
+        camera = cv2_capture(
+            (args.width, args.height),
+            device=device,
+            yuyv=args.yuyv,
+            fps=args.fps or 30,
+            negotiate_format=args.negotiate_format
+        )
+        if args.threaded_capture:
+            config = camera.config
+            camera = ThreadedCV2CaptureManager(
+                camera.capture, camera.resolution, yuyv=camera.yuyv
+            )
+            camera.config = config
+    scanner = QRCodeScanner(
+        url=args.url,
+        scan_workers=args.scan_workers,
+        track_qrcodes=args.track_qrcodes,
+        scan_pyramid=args.scan_pyramid,
+        backend=args.scan_backend,
+        binarization=args.binarization,
+        motion_threshold=args.motion_threshold,
+        throttle_db=args.throttle_db,
+        clip_dir=args.clip_dir,
+        journal=args.journal,
+        journal_batch_size=args.journal_batch_size,
+        journal_linger=args.journal_linger
+    )
+    headless_scanner = HeadlessScanner(camera, scanner, fps=args.fps)
+    try:
+        headless_scanner.run()
+    except KeyboardInterrupt:
+        pass
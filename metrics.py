@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+from array import array
+from threading import Thread, Lock, Event
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+from compat import monotonic
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+    """Keeps the most recent samples in a fixed size ring buffer, plus an
+    all time count and sum"""
+    def __init__(self, size=1024):
+        self.samples = array('d', [0.0]) * size
+        self.index = 0
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.samples[self.index] = value
+        self.index = (self.index + 1) % len(self.samples)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self, quantiles=QUANTILES):
+        """Quantiles of the recent samples"""
+        samples = sorted(self.samples[:min(self.count, len(self.samples))])
+        if not samples:
+            return dict((quantile, None) for quantile in quantiles)
+        last = len(samples) - 1
+        return dict(
+            (quantile, samples[min(int(quantile * len(samples)), last)])
+            for quantile in quantiles
+        )
+
+
+class Timer(object):
+    """Times a with block, into a stage's histogram"""
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = monotonic()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.observe(self.stage, monotonic() - self.start)
+
+
+class Metrics(object):
+    """Per stage timers, and counters"""
+    def __init__(self, size=1024):
+        self.size = size
+        self.histograms = {}
+        self.counters = {}
+        self.lock = Lock()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram(self.size)
+            histogram.observe(seconds)
+
+    def timer(self, stage):
+        return Timer(self, stage)
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def snapshot(self):
+        """Returns the metrics as a dict, suitable for JSON"""
+        with self.lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                quantiles = histogram.quantiles()
+                stages[stage] = dict(
+                    count=histogram.count,
+                    sum=histogram.sum,
+                    p50=quantiles[0.5],
+                    p95=quantiles[0.95],
+                    p99=quantiles[0.99]
+                )
+            return dict(stages=stages, counters=dict(self.counters))
+
+    def prometheus(self):
+        """Returns the metrics in Prometheus text format"""
+        snapshot = self.snapshot()
+        lines = ['# TYPE qrcodescanner_stage_seconds summary']
+        for stage, stats in sorted(snapshot['stages'].items()):
+            for quantile in QUANTILES:
+                value = stats['p{}'.format(int(round(quantile * 100)))]
+                if value is not None:
+                    lines.append(
+                        'qrcodescanner_stage_seconds'
+                        '{{stage="{}",quantile="{}"}} {!r}'.format(
+                            stage, quantile, value
+                        )
+                    )
+            lines.append('qrcodescanner_stage_seconds_sum{{stage="{}"}} {!r}'
+                         .format(stage, stats['sum']))
+            lines.append('qrcodescanner_stage_seconds_count{{stage="{}"}} {}'
+                         .format(stage, stats['count']))
+        lines.append('# TYPE qrcodescanner_events_total counter')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append('qrcodescanner_events_total{{name="{}"}} {}'.format(
+                name, value
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+# Default metrics, shared by the capture managers, scanner, and window.
+METRICS = Metrics()
+
+
+def serve(port, metrics=METRICS, host=''):
+    """Serve the metrics in Prometheus text format, on a daemon thread"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = metrics.prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer((host, port), Handler)
+    thread = Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def write_snapshots(path, interval=10.0, metrics=METRICS):
+    """Write a JSON snapshot of the metrics to path, every interval seconds,
+    on a daemon thread. Returns an event, which stops the writes when set"""
+    stopped = Event()
+
+    def write():
+        while not stopped.wait(interval):
+            try:
+                with open(path, 'w') as f:
+                    json.dump(metrics.snapshot(), f, sort_keys=True)
+            except (IOError, OSError):
+                logger.error('Error writing metrics to {}'.format(path))
+
+    thread = Thread(target=write)
+    thread.daemon = True
+    thread.start()
+    return stopped
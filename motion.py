@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import cv2
+from compat import monotonic
+
+
+class MotionGate(object):
+    """Skips decoding while the scene is static.
+
+    Each frame is downscaled to a small grayscale thumbnail, and compared
+    with the thumbnail of the last scanned frame. If the mean absolute
+    difference is below threshold, and no QR code is being tracked, the
+    frame needn't be scanned. As a safety net, a frame is scanned at least
+    every rescan_interval seconds.
+    """
+    def __init__(
+        self,
+        threshold=4.0,
+        size=(64, 36),
+        rescan_interval=2.0,
+        clock=monotonic
+    ):
+        self.threshold = threshold
+        self.size = size
+        self.rescan_interval = rescan_interval
+        self.clock = clock
+        self.skipped = 0
+        self.difference = None
+        self._reference = None
+        self._scanned_at = None
+
+    def thumbnail(self, frame):
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        return small
+
+    def should_scan(self, frame, tracking=False):
+        """Should the frame, either RGB or grayscale, be scanned?"""
+        now = self.clock()
+        thumbnail = self.thumbnail(frame)
+        if self._reference is not None:
+            self.difference = cv2.absdiff(thumbnail, self._reference).mean()
+        scan = (
+            tracking or
+            self._reference is None or
+            self.difference >= self.threshold or
+            now - self._scanned_at >= self.rescan_interval
+        )
+        if scan:
+            self._reference = thumbnail
+            self._scanned_at = now
+        else:
+            self.skipped += 1
+        return scan
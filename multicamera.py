@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+import os
+import math
+import logging
+import pygame
+import cv2
+import numpy
+from compat import monotonic
+from backends import releases_gil
+from camera import CaptureManager, video_file_capture
+from metrics import METRICS
+from pygamewindow import PygameWindow
+from scanscheduler import ScanScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class CameraStats(object):
+    """Frames per second, and decode latency, for one camera"""
+    def __init__(self):
+        self.fps = 0.0
+        self.frames = 0
+        self.started = monotonic()
+
+    def update(self):
+        self.frames += 1
+        elapsed = monotonic() - self.started
+        if elapsed >= 1.0:
+            self.fps = self.frames / elapsed
+            self.frames = 0
+            self.started = monotonic()
+
+
+class MultiCameraWindow(PygameWindow):
+    """Drives several cameras from one process.
+
+    Each device gets its own capture manager and scanner. Frames from every
+    camera are round robined into one shared pool of scan workers, and the
+    preview is tiled. Devices are camera indexes, video files, or capture
+    managers, for example synthetic frames.
+
+    By default, camera indexes capture on their own threads, so one stalled
+    camera doesn't hold back the others. Video files are read in step with
+    the render loop, so no frame is dropped.
+    """
+    def __init__(
+            self,
+            devices=(0, 1),
+            scan_workers=0,
+            threaded_capture=None,
+            **kwargs):
+        self.devices = devices
+        # By default, one scan worker per camera.
+        super(MultiCameraWindow, self).__init__(
+            scan_workers=scan_workers or len(devices),
+            threaded_capture=threaded_capture,
+            **kwargs
+        )
+
+    def init_camera(self, resolution):
+        self.cameras = [
+            self.open_device(resolution, device) for device in self.devices
+        ]
+        self.camera_stats = [CameraStats() for camera in self.cameras]
+        # The window is fit to the first camera.
+        self.camera = self.cameras[0]
+
+    def open_device(self, resolution, device):
+        if isinstance(device, CaptureManager):
+            return device
+        if not isinstance(device, int) and os.path.isfile(device):
+            return video_file_capture(device)
+        threaded = self.threaded_capture
+        if threaded is None:
+            threaded = isinstance(device, int)
+        return self.open_cached_camera(
+            resolution, device=device, threaded=threaded
+        )
+
+    def init_scanner(self):
+        x, y = self.display_surface.get_size()
+        screen_size_gt_800x400 = ((x * y) >= 320000)
+        box_width = 2 if screen_size_gt_800x400 else 1
+        # One pool of scan workers, shared by every camera, if the backend
+        # releases the GIL. Otherwise, each camera is scanned inline.
+        self.scan_scheduler = None
+        if releases_gil(self.scan_backend):
+            self.scan_scheduler = ScanScheduler(workers=self.scan_workers)
+        self.scanners = []
+        for index, camera in enumerate(self.cameras):
+            kwargs = {}
+            if self.scanners:
+                # Every camera shares the first scanner's throttle stores,
+                # so a QR code seen by two cameras is only authed once.
+                kwargs = dict(
+                    ok_throttles=self.scanners[0].ok_throttles,
+                    not_ok_throttles=self.scanners[0].not_ok_throttles
+                )
+            self.scanners.append(self.create_scanner(
+                box_width=box_width,
+                scan_scheduler=self.scan_scheduler,
+                journal=self.get_journal(index),
+                **kwargs
+            ))
+        self.scanner = self.scanners[0]
+
+    def get_tiles(self, display_size):
+        """Returns a (x, y, w, h) tile per camera, in a grid"""
+        count = len(self.cameras)
+        columns = int(math.ceil(math.sqrt(count)))
+        rows = int(math.ceil(count / float(columns)))
+        w, h = display_size[0] // columns, display_size[1] // rows
+        return [
+            ((index % columns) * w, (index // columns) * h, w, h)
+            for index in range(count)
+        ]
+
+    def init_frame_buffers(self, frame_size, display_size):
+        w, h = display_size
+        self.frame_buffer = numpy.zeros((h, w, 3), dtype=numpy.uint8)
+        self.frame_surface = pygame.image.frombuffer(
+            self.frame_buffer, display_size, 'RGB'
+        )
+        self.tiles = self.get_tiles(display_size)
+        self.resize_buffers = [
+            numpy.empty((th, tw, 3), dtype=numpy.uint8)
+            for tx, ty, tw, th in self.tiles
+        ]
+        self.frame_buffers_size = (frame_size, display_size)
+
+    def render_tile(self, index, frame):
+        """Resize and mirror the frame into its tile of the frame buffer"""
+        display_size = self.display_surface.get_size()
+        if self.frame_buffers_size != (None, display_size):
+            self.init_frame_buffers(None, display_size)
+        x, y, w, h = self.tiles[index]
+        tile = self.frame_buffer[y:y + h, x:x + w]
+        with METRICS.timer('resize'):
+            if self.mirror_frame:
+                frame = cv2.resize(
+                    frame, (w, h), dst=self.resize_buffers[index]
+                )
+                cv2.flip(frame, 1, dst=tile)
+            else:
+                cv2.resize(frame, (w, h), dst=tile)
+
+    def main(self):
+        # Every camera is scanned on the same frames.
+        scan = self.scan_pacer.due()
+        updated = []
+        for index, camera in enumerate(self.cameras):
+            camera.enter_frame()
+            frame = camera.rgb
+            if frame is not None and frame.size:
+                scanner = self.scanners[index]
+                gray = camera.gray if scan else None
+                frame = scanner.main(
+                    frame,
+                    self.timestamp,
+                    scan=scan,
+                    gray=gray,
+                    captured=camera.frame_time
+                )
+                self.render_tile(index, frame)
+                self.camera_stats[index].update()
+                updated.append(self.tiles[index])
+            camera.exit_frame()
+        if scan and updated and 'first_scan' not in self.startup_times:
+            self.report_startup()
+        # Only blit, and update, the tiles with new frames. Debug text is
+        # drawn over every tile, so then all of them are.
+        if self.debug and updated:
+            updated = self.tiles
+        with METRICS.timer('blit'):
+            for x, y, w, h in updated:
+                self.dirty_rects.append(self.display_surface.blit(
+                    self.frame_surface, (x, y), area=(x, y, w, h)
+                ))
+
+    def get_journal(self, index):
+        """Each scanner uploads its own journal, so entries aren't sent
+        twice"""
+        if self.journal is None or index == 0:
+            return self.journal
+        return '{}.{}'.format(self.journal, index)
+
+    def get_camera_stats(self):
+        """Per camera FPS, and decode latency in seconds"""
+        return [
+            dict(
+                device=index if isinstance(device, CaptureManager) else device,
+                fps=stats.fps,
+                decode_latency=scanner.decode_latency
+            )
+            for index, (device, stats, scanner) in enumerate(zip(
+                self.devices, self.camera_stats, self.scanners
+            ))
+        ]
+
+    def display_successes(self):
+        RED = (255, 0, 0)
+        successes = sum(scanner.successes for scanner in self.scanners)
+        msg = u'{} OK'.format(successes)
+        self.display_debug_msg(msg, RED, 80)
+        self.display_camera_stats()
+
+    def display_camera_stats(self):
+        WHITE = (255, 255, 255)
+        for index, stats in enumerate(self.get_camera_stats()):
+            latency = stats['decode_latency'] or 0.0
+            msg = u'{} {} FPS {} MS'.format(
+                stats['device'],
+                int(round(stats['fps'])),
+                int(round(latency * 1000))
+            )
+            self.display_debug_msg(msg, WHITE, 115 + index * 35)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Command line options shared by example.py and headless.py"""
+import metrics
+
+
+def add_scanner_arguments(parser):
+    """Options for capture, scanning, auths and metrics"""
+    parser.add_argument(
+        '--width',
+        dest='width',
+        action='store',
+        type=int,
+        default=640
+    )
+    parser.add_argument(
+        '--height',
+        dest='height',
+        action='store',
+        type=int,
+        default=480
+    )
+    parser.add_argument(
+        '--url',
+        dest='url',
+        action='store',
+        default=None,
+        help='Auth QR codes with this server. Journals and clips need one'
+    )
+    parser.add_argument(
+        '--scan-workers',
+        dest='scan_workers',
+        action='store',
+        type=int,
+        default=0,
+        help='Scan threads, only with backends that release the GIL, '
+        'opencv and pyzbar'
+    )
+    parser.add_argument(
+        '--track-qrcodes',
+        dest='track_qrcodes',
+        action='store',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--scan-pyramid',
+        dest='scan_pyramid',
+        action='store',
+        type=float,
+        nargs='+',
+        default=[1.0]
+    )
+    parser.add_argument(
+        '--scan-backend',
+        dest='scan_backend',
+        action='store',
+        choices=['zbar', 'pyzbar', 'opencv'],
+        default='zbar'
+    )
+    parser.add_argument(
+        '--binarization',
+        dest='binarization',
+        action='store',
+        choices=['gray', 'otsu', 'adaptive', 'clahe'],
+        nargs='+',
+        default=['otsu']
+    )
+    parser.add_argument(
+        '--motion-threshold',
+        dest='motion_threshold',
+        action='store',
+        type=float,
+        default=0.0,
+        help='Skip decoding static scenes, 0 to disable'
+    )
+    parser.add_argument(
+        '--threaded-capture',
+        dest='threaded_capture',
+        action='store_true',
+        default=None,
+        help='Capture on a dedicated thread. With several devices, camera '
+        'indexes do by default'
+    )
+    parser.add_argument(
+        '--yuyv',
+        dest='yuyv',
+        action='store_true',
+        help='Capture YUYV, and scan the luma plane without conversion'
+    )
+    parser.add_argument(
+        '--negotiate-format',
+        dest='negotiate_format',
+        action='store_true',
+        help='Capture in the format that delivers the most FPS'
+    )
+    parser.add_argument(
+        '--throttle-db',
+        dest='throttle_db',
+        action='store',
+        help='Share throttled QR codes between processes, by way of this '
+        'SQLite database'
+    )
+    parser.add_argument(
+        '--journal',
+        dest='journal',
+        action='store',
+        help='Store and forward auths in batches, journaled to this path'
+    )
+    parser.add_argument(
+        '--journal-batch-size',
+        dest='journal_batch_size',
+        action='store',
+        type=int,
+        default=10
+    )
+    parser.add_argument(
+        '--journal-linger',
+        dest='journal_linger',
+        action='store',
+        type=float,
+        default=1.0,
+        help='Seconds to wait for a batch to fill'
+    )
+    parser.add_argument(
+        '--clip-dir',
+        dest='clip_dir',
+        action='store',
+        help='Write a short clip around each auth to this directory'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        dest='metrics_port',
+        action='store',
+        type=int,
+        default=None,
+        help='Serve metrics in Prometheus text format'
+    )
+    parser.add_argument(
+        '--metrics-snapshot',
+        dest='metrics_snapshot',
+        action='store',
+        default=None,
+        help='Write a JSON snapshot of metrics to this path periodically'
+    )
+    parser.add_argument('--debug', dest='debug', action='store_true')
+
+
+def start_metrics(args):
+    """Serve, or write snapshots of, metrics, if asked to"""
+    if args.metrics_port is not None:
+        metrics.serve(args.metrics_port)
+    if args.metrics_snapshot is not None:
+        metrics.write_snapshots(args.metrics_snapshot)
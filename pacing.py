@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import time
+from compat import monotonic
+from metrics import METRICS, Histogram
+
+
+class FramePacer(object):
+    """Paces frames against monotonic deadlines.
+
+    wait() sleeps until the next frame's deadline, and never sleeps when the
+    frame is late. With skip_frames, a loop which falls more than a frame
+    behind drops the missed deadlines, rather than running flat out to catch
+    up. Jitter is how late each frame starts, relative to its deadline.
+    """
+    def __init__(
+        self,
+        fps,
+        skip_frames=True,
+        size=256,
+        clock=monotonic,
+        sleep=time.sleep
+    ):
+        self.interval = 1.0 / fps if fps else 0.0
+        self.skip_frames = skip_frames
+        self.clock = clock
+        self.sleep = sleep
+        self.skipped = 0
+        self.jitter = Histogram(size)
+        self.work = Histogram(size)
+        self.work_time = 0.0
+        self._deadline = None
+        self._frame_started = None
+
+    def wait(self):
+        """Call once per frame, after the frame's work"""
+        now = self.clock()
+        if self._frame_started is not None:
+            self.work_time = now - self._frame_started
+            self.work.observe(self.work_time)
+            METRICS.observe('frame_work', self.work_time)
+        if not self.interval:
+            self._frame_started = now
+            return
+        if self._deadline is None:
+            self._deadline = now
+        else:
+            delay = self._deadline - now
+            if delay > 0:
+                self.sleep(delay)
+            elif self.skip_frames and -delay > self.interval:
+                missed = int(-delay / self.interval)
+                self.skipped += missed
+                self._deadline += missed * self.interval
+        started = self.clock()
+        jitter = max(started - self._deadline, 0.0)
+        self.jitter.observe(jitter)
+        METRICS.observe('frame_jitter', jitter)
+        self._deadline += self.interval
+        self._frame_started = started
+
+    def stats(self):
+        """Jitter and work time percentiles in seconds, and skipped
+        frames"""
+        jitter = self.jitter.quantiles()
+        work = self.work.quantiles()
+        return dict(
+            jitter_p50=jitter[0.5],
+            jitter_p95=jitter[0.95],
+            jitter_p99=jitter[0.99],
+            work_p50=work[0.5],
+            work_p95=work[0.95],
+            work_p99=work[0.99],
+            skipped=self.skipped
+        )
+
+
+class ScanPacer(object):
+    """Decides which displayed frames are scanned, so that decoding may run
+    at a lower rate than the display.
+
+    With scan_fps=0, every frame is scanned. With adaptive, the scan rate
+    drops while frames overrun their budget, down to min_scan_fps, and
+    recovers when there is headroom, up to max_scan_fps.
+    """
+    def __init__(
+        self,
+        scan_fps=0,
+        adaptive=False,
+        min_scan_fps=2.0,
+        max_scan_fps=30.0,
+        clock=monotonic
+    ):
+        self.adaptive = adaptive
+        self.min_scan_fps = min_scan_fps
+        self.max_scan_fps = scan_fps or max_scan_fps
+        self.scan_fps = scan_fps or (max_scan_fps if adaptive else 0)
+        self.clock = clock
+        self.skipped = 0
+        self._next_scan = None
+
+    def due(self):
+        """Should this frame be scanned?"""
+        if not self.scan_fps:
+            return True
+        now = self.clock()
+        if self._next_scan is None or now >= self._next_scan:
+            self._next_scan = now + 1.0 / self.scan_fps
+            return True
+        self.skipped += 1
+        return False
+
+    def adapt(self, work_time, budget):
+        """Lower the scan rate if the frame overran its budget, or raise it
+        if there was headroom"""
+        if not self.adaptive or not budget:
+            return
+        if work_time > budget:
+            self.scan_fps = max(self.scan_fps * 0.8, self.min_scan_fps)
+        elif work_time < budget * 0.7:
+            self.scan_fps = min(self.scan_fps * 1.1, self.max_scan_fps)
@@ -1,17 +1,29 @@
 # -*- coding: utf-8 -*-
 import datetime
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 import pygame
 import cv2
 import numpy
 from pygame.locals import K_ESCAPE
+from compat import monotonic
 from camera import (
-    SIXTEEN_BY_TEN, SIXTEEN_BY_NINE, FOUR_BY_THREE, cv2_capture
+    SIXTEEN_BY_TEN, SIXTEEN_BY_NINE, FOUR_BY_THREE, cv2_capture,
+    ThreadedCV2CaptureManager
 )
+from metrics import METRICS
+from pacing import FramePacer, ScanPacer
 from qrcodescanner import QRCodeScanner
+from startupcache import StartupCache, device_identity
 
 logger = logging.getLogger(__name__)
 
+DEBUG_FONT_SIZE = 32
+SYSTEM_FONT_SIZE = 48
+# Debug text changes often, for example FPS, so bound the cache.
+MAX_TEXT_SURFACES = 256
+
 
 class PygameWindow(object):
     def __init__(
@@ -23,37 +35,118 @@ class PygameWindow(object):
             max_qrcode_size=0.0,
             ok_throttle=60,
             not_ok_throttle=3,
+            throttle_db=None,
             resolution=(1280, 720),
+            device=0,
             fps=30.0,
+            skip_frames=True,
+            scan_fps=0,
+            adaptive_scan=False,
             mirror_frame=True,
+            threaded_capture=False,
+            yuyv=False,
+            negotiate_format=False,
+            scan_workers=0,
+            track_qrcodes=0,
+            scan_pyramid=(1.0, ),
+            scan_backend='zbar',
+            binarization=('otsu', ),
+            motion_threshold=0.0,
             network_timeout=10,
+            startup_cache=None,
+            clip_dir=None,
+            journal=None,
+            journal_batch_size=10,
+            journal_linger=1.0,
             fullscreen=True,
             debug=False):
+        self.started = monotonic()
+        # Seconds taken by each stage of startup, until the first scan.
+        self.startup_times = OrderedDict()
         self.url = url
         self.api_key = api_key
         self.ok_throttle = ok_throttle
         self.not_ok_throttle = not_ok_throttle
+        self.throttle_db = throttle_db
         self.max_qrcode_size = max_qrcode_size
         self.resolution = resolution
+        self.device = device
         self.fps = fps
         self.mirror_frame = mirror_frame
+        self.frame_buffers_size = None
+        self.threaded_capture = threaded_capture
+        self.yuyv = yuyv
+        self.negotiate_format = negotiate_format
+        self.scan_workers = scan_workers
+        self.track_qrcodes = track_qrcodes
+        self.scan_pyramid = scan_pyramid
+        self.scan_backend = scan_backend
+        self.binarization = binarization
+        self.motion_threshold = motion_threshold
         self.font = font
+        # Fonts are cached by size, and rendered text by string.
+        self.fonts = {}
+        self.text_surfaces = {}
+        # Regions of the display drawn this frame, see update_display().
+        self.dirty_rects = []
         self.timestamp = datetime.datetime.now()
         self.clock = pygame.time.Clock()
+        self.pacer = FramePacer(fps, skip_frames=skip_frames)
+        # Scan at scan_fps, which may be lower than the display rate.
+        self.scan_pacer = ScanPacer(
+            scan_fps, adaptive=adaptive_scan, max_scan_fps=fps or 30.0
+        )
         self.network_timeout = network_timeout
+        self.clip_dir = clip_dir
+        self.journal = journal
+        self.journal_batch_size = journal_batch_size
+        self.journal_linger = journal_linger
         self.debug = debug
-        pygame.init()
-        pygame.display.init()
-        pygame.mixer.init()
+        # The camera and display configuration negotiated last time.
+        self.startup_cache = StartupCache(startup_cache)
+        # Only what's needed to display frames. Modules such as the mixer
+        # are slow to initialize, see get_mixer().
+        with self.startup_stage('pygame'):
+            pygame.display.init()
+            pygame.font.init()
         # First, initialize camera.
-        self.init_camera(resolution)
+        with self.startup_stage('camera'):
+            self.init_camera(resolution)
         # Then, initialize the pygame window with the same resolution as the
         # camera.
-        self.init_window(name, self.camera.resolution, fullscreen=fullscreen)
+        with self.startup_stage('window'):
+            self.init_window(
+                name, self.camera.resolution, fullscreen=fullscreen
+            )
         # Finally, initialize the scanner.
-        self.init_scanner()
+        with self.startup_stage('scanner'):
+            self.init_scanner()
+        self.startup_cache.save()
         self.is_window_active = True
 
+    @contextmanager
+    def startup_stage(self, stage):
+        started = monotonic()
+        yield
+        self.startup_times[stage] = monotonic() - started
+
+    def report_startup(self):
+        """Log, and record as metrics, how long startup took"""
+        self.startup_times['first_scan'] = monotonic() - self.started
+        for stage, seconds in self.startup_times.items():
+            METRICS.observe('startup_{}'.format(stage), seconds)
+        logger.info('Startup {}'.format(', '.join(
+            '{} {:.3f}s'.format(stage, seconds)
+            for stage, seconds in self.startup_times.items()
+        )))
+
+    def get_mixer(self):
+        """The mixer is initialized when first used, as few windows play
+        sounds"""
+        if not pygame.mixer.get_init():
+            pygame.mixer.init()
+        return pygame.mixer
+
     def get_current_resolution(self):
         display = pygame.display.Info()
         # display.current_w and display.current_h may return -1
@@ -87,30 +180,73 @@ class PygameWindow(object):
         return resolutions
 
     def init_camera(self, resolution):
-        def set_camera(resolutions):
-            for resolution in resolutions:
-                if not hasattr(self, 'camera'):
-                    self.set_camera(resolution)
-                else:
-                    break
-        if resolution == (0, 0):
-            resolutions = self.get_resolutions_for_current_aspect_ratio()
-            set_camera(resolutions)
-        else:
-            set_camera([resolution])
+        self.camera = self.open_cached_camera(resolution, device=self.device)
 
     def set_camera(self, resolution):
-        camera = cv2_capture(resolution)
+        self.camera = self.open_camera(resolution, device=self.device)
+
+    def open_cached_camera(self, resolution, device=0, threaded=None):
+        """Open the camera with the resolution, and format, it negotiated
+        last time, if cached, which skips walking display modes, probing
+        formats and retrying"""
+        key = '{} {}x{}'.format(
+            device_identity(device), resolution[0], resolution[1]
+        )
+        cached = self.startup_cache.get('camera ' + key)
+        if cached is not None:
+            resolution = tuple(cached)
+        elif resolution == (0, 0):
+            resolutions = self.get_resolutions_for_current_aspect_ratio()
+            if resolutions:
+                resolution = resolutions[0]
+        fourcc = self.startup_cache.get('format ' + key)
+        camera = self.open_camera(
+            resolution, device=device, fourcc=fourcc, threaded=threaded
+        )
+        self.startup_cache.set('camera ' + key, camera.resolution)
+        self.startup_cache.set('format ' + key, camera.config.fourcc)
+        return camera
+
+    def open_camera(self, resolution, device=0, fourcc=None, threaded=None):
+        if threaded is None:
+            threaded = self.threaded_capture
+        kwargs = dict(
+            device=device,
+            yuyv=self.yuyv,
+            fps=self.fps or 30,
+            fourcc=fourcc,
+            negotiate_format=self.negotiate_format
+        )
+        camera = cv2_capture(resolution, **kwargs)
         if camera.resolution != resolution:
             # Setting resolution may fail, without an error, try 3 times.
             # Could this be because the camera is not fully initialized...
+            # Don't negotiate the format again.
+            kwargs['fourcc'] = camera.config.fourcc
             for i in range(3):
-                camera = cv2_capture(resolution)
+                # The device can't be opened twice.
+                camera.capture.release()
+                camera = cv2_capture(resolution, **kwargs)
                 if camera.resolution == resolution:
                     break
-        self.camera = camera
+        if threaded:
+            # Grab frames on a dedicated thread, so camera stalls don't
+            # block the render loop.
+            threaded = ThreadedCV2CaptureManager(
+                camera.capture, camera.resolution, yuyv=camera.yuyv
+            )
+            threaded.config = camera.config
+            camera = threaded
+        return camera
 
     def fit_camera_to_display(self):
+        # Walking display modes is slow, so the fit is cached.
+        key = 'display {}x{} {}x{}'.format(
+            *(self.get_current_resolution() + self.camera.resolution)
+        )
+        cached = self.startup_cache.get(key)
+        if cached is not None:
+            return tuple(cached)
         resolutions = self.get_resolutions_for_current_aspect_ratio()
         cam = self.camera.resolution
         logger.info('Supported resolutions {}'.format(resolutions))
@@ -121,14 +257,17 @@ class PygameWindow(object):
             key=lambda r: abs((cam[0] * cam[1]) - (r[0] * r[1]))
         )
         logger.info('Best resolution {}'.format(fit_to_camera))
+        self.startup_cache.set(key, fit_to_camera)
         return fit_to_camera
 
     def init_window(self, name, resolution, fullscreen=False):
         pygame.display.set_caption(name)
         if fullscreen:
+            # Not double buffered, as update_display() only updates the
+            # regions drawn, which flip() doesn't support.
             self.display_surface = pygame.display.set_mode(
                 self.fit_camera_to_display(),
-                pygame.DOUBLEBUF | pygame.HWSURFACE | pygame.FULLSCREEN
+                pygame.FULLSCREEN
             )
         else:
             self.display_surface = pygame.display.set_mode(
@@ -136,68 +275,99 @@ class PygameWindow(object):
                 pygame.RESIZABLE
             )
 
-        if self.debug:
-            self.debug_font = self.get_font_size(32)
-
         self.load_user_interface()
 
     def get_font_size(self, size):
-        if self.font:
-            font = pygame.font.Font(self.font, size)
-        else:
-            font = pygame.font.SysFont(None, size)
+        font = self.fonts.get(size)
+        if font is None:
+            if self.font:
+                font = pygame.font.Font(self.font, size)
+            else:
+                font = pygame.font.SysFont(None, size)
+            self.fonts[size] = font
         return font
 
+    def render_text(self, msg, color, size):
+        """Render text, or reuse the surface from when it was last rendered"""
+        key = (msg, color, size)
+        surface = self.text_surfaces.get(key)
+        if surface is None:
+            if len(self.text_surfaces) >= MAX_TEXT_SURFACES:
+                self.text_surfaces.clear()
+            surface = self.get_font_size(size).render(msg, True, color)
+            self.text_surfaces[key] = surface
+        return surface
+
     def load_user_interface(self):
         self.system_message(startup=True)
 
     def system_message(self, msg='Loading...', startup=False):
         BLACK = (0, 0, 0)
         ALICE_BLUE = (240, 248, 255)
-        msg = self.get_font_size(48).render(
-            msg, True, ALICE_BLUE
-        )
+        msg = self.render_text(msg, ALICE_BLUE, SYSTEM_FONT_SIZE)
         w, h = self.display_surface.get_size()
         w = w - msg.get_width()
         h = h - msg.get_height()
-        self.display_surface.fill(BLACK)
+        self.dirty_rects.append(self.display_surface.fill(BLACK))
         self.display_surface.blit(msg, (int(w / 2.0), int(h / 2)))
         if startup:
-            pygame.display.flip()
+            self.update_display()
 
     def init_scanner(self):
         # Init QR code scanner
         x, y = self.display_surface.get_size()
         screen_size_gt_800x400 = ((x * y) >= 320000)
         box_width = 2 if screen_size_gt_800x400 else 1
-        self.scanner = QRCodeScanner(
-            url=self.url, box_width=box_width, debug=self.debug
+        self.scanner = self.create_scanner(
+            box_width=box_width, scan_workers=self.scan_workers
+        )
+
+    def create_scanner(self, **kwargs):
+        options = dict(
+            url=self.url,
+            max_qrcode_size=self.max_qrcode_size,
+            ok_throttle=self.ok_throttle,
+            not_ok_throttle=self.not_ok_throttle,
+            throttle_db=self.throttle_db,
+            track_qrcodes=self.track_qrcodes,
+            scan_pyramid=self.scan_pyramid,
+            backend=self.scan_backend,
+            binarization=self.binarization,
+            motion_threshold=self.motion_threshold,
+            clip_dir=self.clip_dir,
+            journal=self.journal,
+            journal_batch_size=self.journal_batch_size,
+            journal_linger=self.journal_linger,
+            debug=self.debug
         )
+        options.update(kwargs)
+        return QRCodeScanner(**options)
 
     def main(self):
         # Prefered interface to OpenCV, with cv2.VideoCapture.grab()
         self.camera.enter_frame()
-        if self.camera.frame is not None:
-            if not self.camera.frame.size:
+        if self.camera.rgb is not None:
+            if not self.camera.rgb.size:
                 self.system_message(msg='Invalid frame from camera.')
             else:
-                frame = self.scanner.main(self.camera.frame, self.timestamp)
-                frame = self.resize_frame(frame)
-                # Find the frame's dimensions in (w, h) format.
-                frame_size = frame.shape[1::-1]
-                # Mirror preview after processing, or ZBar can't find QR codes.
-                if self.mirror_frame:
-                    frame = numpy.fliplr(frame)
-                # Convert the frame to Pygame's Surface type.
-                pygame_frame = pygame.image.frombuffer(
-                    frame.tostring(), frame_size, 'RGB'
+                scan = self.scan_pacer.due()
+                # The grayscale view is only converted if it's scanned.
+                frame = self.scanner.main(
+                    self.camera.rgb,
+                    self.timestamp,
+                    scan=scan,
+                    gray=self.camera.gray if scan else None,
+                    captured=self.camera.frame_time
                 )
-                self.display_surface.blit(pygame_frame, (0, 0))
+                self.render_frame(frame)
+                if scan and 'first_scan' not in self.startup_times:
+                    self.report_startup()
         # Exit frame.
         self.camera.exit_frame()
 
     def update_user_interface(self):
-        """Subclass to customize this method."""
+        """Subclass to customize this method. Append any region drawn
+        outside of the frame to self.dirty_rects"""
         pass
 
     def update_timestamp(self):
@@ -205,11 +375,9 @@ class PygameWindow(object):
 
     def display_debug_msg(self, msg, color, y_pos):
         w, h = self.display_surface.get_size()
-        msg = self.debug_font.render(
-            msg, True, color
-        )
+        msg = self.render_text(msg, color, DEBUG_FONT_SIZE)
         w = w - (msg.get_width() + 20)
-        self.display_surface.blit(msg, (w, y_pos))
+        self.dirty_rects.append(self.display_surface.blit(msg, (w, y_pos)))
 
     def display_resolution(self):
         BLUE = (0, 0, 255)
@@ -233,13 +401,59 @@ class PygameWindow(object):
         w, h = self.display_surface.get_size()
         return cv2.resize(frame, (w, h))
 
+    def init_frame_buffers(self, frame_size, display_size):
+        """Preallocate the display path. The frame surface shares memory with
+        the frame buffer, so writing to the buffer updates the surface"""
+        w, h = display_size
+        self.frame_buffer = numpy.empty((h, w, 3), dtype=numpy.uint8)
+        self.frame_surface = pygame.image.frombuffer(
+            self.frame_buffer, display_size, 'RGB'
+        )
+        # Skip the resize when the camera and display resolutions match,
+        # as fit_camera_to_display() tries to arrange.
+        self.skip_resize = (frame_size == display_size)
+        if not self.skip_resize and self.mirror_frame:
+            self.resize_buffer = numpy.empty((h, w, 3), dtype=numpy.uint8)
+        else:
+            self.resize_buffer = self.frame_buffer
+        self.frame_buffers_size = (frame_size, display_size)
+
+    def render_frame(self, frame):
+        """Resize and mirror the frame into the frame buffer, then blit it.
+        Allocates nothing, unless the frame or display size changed"""
+        # Find the frame's dimensions in (w, h) format.
+        frame_size = frame.shape[1::-1]
+        display_size = self.display_surface.get_size()
+        if self.frame_buffers_size != (frame_size, display_size):
+            self.init_frame_buffers(frame_size, display_size)
+        with METRICS.timer('resize'):
+            if not self.skip_resize:
+                frame = cv2.resize(
+                    frame, display_size, dst=self.resize_buffer
+                )
+            # Mirror preview after processing, or ZBar can't find QR codes.
+            if self.mirror_frame:
+                cv2.flip(frame, 1, dst=self.frame_buffer)
+            elif self.skip_resize:
+                numpy.copyto(self.frame_buffer, frame)
+        with METRICS.timer('blit'):
+            rect = self.display_surface.blit(self.frame_surface, (0, 0))
+        self.dirty_rects.append(rect)
+
+    def update_display(self):
+        """Update only the regions drawn since the last update. If nothing
+        was drawn, for example no new frame was captured, nothing is"""
+        if self.dirty_rects:
+            with METRICS.timer('present'):
+                pygame.display.update(self.dirty_rects)
+            del self.dirty_rects[:]
+
     def update_fps(self):
+        # Sleep until the next frame's deadline, then adapt the scan rate
+        # to the time this frame's work took.
+        self.pacer.wait()
+        self.scan_pacer.adapt(self.pacer.work_time, self.pacer.interval)
         self.clock.tick()
-        fps = self.clock.get_fps()
-        if self.fps:
-            if fps > self.fps:
-                delay = int(1000.0 / (fps - self.fps))
-                pygame.time.delay(delay)
         return self.clock.get_fps()
 
     def process_events(self):
@@ -259,11 +473,12 @@ class PygameWindow(object):
         self.update_user_interface()
         self.update_timestamp()
         fps = self.update_fps()
-        if self.debug:
+        # Debug text is drawn over the frame, so only redraw it with one.
+        if self.debug and self.dirty_rects:
             self.display_resolution()
             self.display_fps(fps)
             self.display_successes()
-        pygame.display.flip()
+        self.update_display()
         self.process_events()
 
     def run(self):
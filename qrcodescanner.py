@@ -1,85 +1,133 @@
 # -*- coding: utf-8 -*-
-import os
+import time
 import datetime
 import logging
 import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
 import numpy
 import cv2
-import zbar
-from Queue import Queue
-from threading import Thread
-from PIL import Image
+try:
+    from Queue import Queue
+except ImportError:
+    # Python 3, which asyncauth requires.
+    from queue import Queue
+from collections import deque
+from functools import partial
+from multiprocessing.pool import ThreadPool
+from compat import monotonic
+from authpool import AuthWorkerPool
+from metrics import METRICS
+from motion import MotionGate
+from backends import ScanBackend, get_backend, releases_gil
+from binarization import Binarizer
+from framering import FrameRing, write_clip
+from scanscheduler import ScanScheduler
+from throttle import ThrottleStore, SQLiteThrottleStore
+from tracker import QRCodeTracker
 
 logger = logging.getLogger(__name__)
-TEMP_DIR = os.path.join(os.getcwd(), 'temp')
 
+# From OpenCV 3.0.0, cv2.CV_AA was renamed cv2.LINE_AA
+LINE_AA = getattr(cv2, 'LINE_AA', None) or cv2.CV_AA
 
-def get_temp_dir():
-    """Create TEMP_DIR if it doesn't exist"""
-    if not os.path.exists(TEMP_DIR):
-        os.mkdir(TEMP_DIR)
-    return TEMP_DIR
 
-
-def thumbnail(picture, size=0.50):
-    """Thumbnail the picture"""
-    width, height = picture.size
-    w, h = int(width * size), int(height * size)
-    picture.thumbnail((w, h), Image.ANTIALIAS)
-    return picture
-
-
-def save_picture(picture, path, filename):
-    """Save picture to filesystem, return the path"""
-    # Unfortunately, StringIO was unsatisfactory
-    # StringIO size exceeds size of filesystem save. Why??
-    storage = os.path.join(path, filename)
-    picture.save(storage, optimize=True, format='JPEG')
-    return storage
-
-
-def delete_picture(path):
-    """Delete the file, with a try except clause"""
-    try:
-        os.remove(path)
-    # Gee! Thanks Windows
-    except:
-        pass
+def encode_picture(frame, quality=80, scale=0.5):
+    """Encode the RGB frame as JPEG, in memory, optionally downscaled"""
+    if scale != 1.0:
+        frame = cv2.resize(
+            frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
+        )
+    # OpenCV encodes BGR.
+    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    ok, buf = cv2.imencode(
+        '.jpeg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    )
+    if not ok:
+        raise ValueError('Error encoding picture')
+    return buf.tobytes()
 
 
-def prepare_msg(qrcode, picture, timestamp):
+def prepare_msg(qrcode, picture, timestamp, quality=80, scale=0.5):
     """Prepare message to send to server"""
     timestamp = datetime.datetime.strftime(timestamp, '%Y%m%d%H%M%S%f')
     filename = '{}.jpeg'.format(timestamp)
-    temp_storage = save_picture(picture, get_temp_dir(), filename)
     data = dict(qrcode=qrcode, timestamp=timestamp)
-    files = {'picture': temp_storage}
+    jpeg = encode_picture(picture, quality=quality, scale=scale)
+    files = {'picture': (filename, jpeg, 'image/jpeg')}
     return filename, data, files
 
 
-def server_auth(queue, url, qrcode, picture, timestamp, timeout=5):
-    """Send message to server for auth"""
-    filename, data, files = prepare_msg(qrcode, picture, timestamp)
+def is_connect_error(e):
+    """Did the request fail to connect, so the server never saw it?"""
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and e.args:
+        reason = getattr(e.args[0], 'reason', None)
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def post(session, url, data, files, timeout=5, retries=0, backoff=0.5):
+    """POST, retrying with exponential backoff on connect errors. Auths
+    aren't idempotent, so a request the server may have seen, for example
+    one that timed out reading the response, isn't retried"""
+    for attempt in range(retries + 1):
+        try:
+            return session.post(url, data=data, files=files, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            if attempt == retries or not is_connect_error(e):
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+def server_auth(queue, url, qrcode, picture, timestamp, **kwargs):
+    """Send message to server for auth. Puts the QR code, and the
+    response, on the queue"""
+    response = request_auth(url, qrcode, picture, timestamp, **kwargs)
+    queue.put((qrcode, response))
+
+
+def request_auth(
+    url,
+    qrcode,
+    picture,
+    timestamp,
+    timeout=5,
+    session=None,
+    retries=0,
+    backoff=0.5,
+    quality=80,
+    scale=0.5
+):
+    """Send message to server for auth, and return the response"""
+    filename, data, files = prepare_msg(
+        qrcode, picture, timestamp, quality=quality, scale=scale
+    )
     try:
-        if logger.getEffectiveLevel() >= logging.INFO:
-            # Profile the request
-            start = datetime.datetime.now()
-        r = requests.post(url, data=data, files=files, timeout=timeout)
-        if logger.getEffectiveLevel >= logging.INFO:
-            # Profile the request
-            end = datetime.datetime.now()
-            elapsed_time = (end - start).total_seconds()
-            logger.info('Elapsed time was {} seconds'.format(elapsed_time))
+        # Profile the request
+        start = monotonic()
+        r = post(
+            session or requests,
+            url,
+            data,
+            files,
+            timeout=timeout,
+            retries=retries,
+            backoff=backoff
+        )
+        elapsed_time = monotonic() - start
+        METRICS.observe('http', elapsed_time)
+        logger.info('Elapsed time was {} seconds'.format(elapsed_time))
+        # For example, an HTML error page from a proxy isn't JSON.
+        response = r.json()
     except Exception as e:
         response = None
         # Did the request timeout?
         if isinstance(e, requests.exceptions.Timeout):
             response = dict(network_timeout=True)
-    else:
-        response = r.json()
-    finally:
-        delete_picture(os.path.join(get_temp_dir(), filename))
-    queue.put(response)
+        else:
+            logger.info('Auth failed for {}, {}'.format(qrcode, e))
+    return response
 
 
 class QRCodeScanner(object):
@@ -87,51 +135,265 @@ class QRCodeScanner(object):
         self,
         url=None,
         max_responses=2,
+        max_qrcode_size=0.0,
         timeout=5,
         ok_color=(0, 0, 255),
         not_ok_color=(255, 0, 0),
         box_width=1,
+        scan_workers=0,
+        scan_scheduler=None,
+        track_qrcodes=0,
+        track_padding=0.5,
+        full_scan_interval=15,
+        scan_pyramid=(1.0, ),
+        backend=None,
+        binarization=('otsu', ),
+        max_strategies=2,
+        motion_threshold=0.0,
+        motion_rescan_interval=2.0,
+        auth_workers=2,
+        auth_queue_size=8,
+        auth_retries=2,
+        async_auth=False,
+        journal=None,
+        journal_batch_size=10,
+        journal_linger=1.0,
+        picture_quality=80,
+        picture_scale=0.5,
+        clip_dir=None,
+        clip_before=2.0,
+        clip_after=1.0,
+        ok_throttle=60,
+        not_ok_throttle=3,
+        max_throttled=10000,
+        throttle_db=None,
+        ok_throttles=None,
+        not_ok_throttles=None,
         debug=False
     ):
         self.url = url
         self.timeout = timeout
-        self.max_responses
-        self.thread = None
+        self.max_responses = max_responses
+        # Ignore QR codes larger than this fraction of the frame, if set.
+        self.max_qrcode_size = max_qrcode_size
         self.queue = Queue()
-        # Init zbar.
-        self.scanner = zbar.ImageScanner()
-        # Disable all zbar symbols.
-        self.scanner.set_config(0, zbar.Config.ENABLE, 0)
-        # Enable QRCodes.
-        self.scanner.set_config(zbar.Symbol.QRCODE, zbar.Config.ENABLE, 1)
+        # Auth worker pool, started on the first auth.
+        self.auth_pool = None
+        self.auth_workers = auth_workers
+        self.auth_queue_size = auth_queue_size
+        self.auth_retries = auth_retries
+        self.async_auth = async_auth
+        # Optionally, store and forward auths in batches, by way of an
+        # SQLite journal at this path.
+        self.journal = journal
+        # Seconds to throttle QR codes after OK, and after sending.
+        self.ok_throttle = ok_throttle
+        self.not_ok_throttle = not_ok_throttle
+        # Throttle stores are in memory, or shared between processes on the
+        # host by way of an SQLite database at throttle_db. Scanners in the
+        # same process may share stores, by passing them in.
+        self.max_throttled = max_throttled
+        self.throttle_db = throttle_db
+        if ok_throttles is None:
+            ok_throttles = self.create_throttle_store('ok_throttles')
+        if not_ok_throttles is None:
+            not_ok_throttles = self.create_throttle_store('not_ok_throttles')
+        self.ok_throttles = ok_throttles
+        self.not_ok_throttles = not_ok_throttles
+        # QR codes with an auth in flight.
+        self.active_qrcodes = set()
+        # Most recent OK responses, for GUI.
+        self.responses = deque(maxlen=max_responses)
+        # JPEG quality, and downscale, of the picture sent to the server.
+        self.picture_quality = picture_quality
+        self.picture_scale = picture_scale
+        if journal is not None and url is not None:
+            # Started now, rather than on the first auth, so entries left
+            # unsent by the last run are replayed on start.
+            from authjournal import AuthJournal
+            self.auth_pool = AuthJournal(
+                self.queue,
+                url,
+                journal,
+                batch_size=journal_batch_size,
+                linger=journal_linger,
+                timeout=timeout,
+                quality=picture_quality,
+                scale=1.0
+            )
+        # Optionally, write a short clip from before, until after, each auth.
+        self.frame_ring = None
+        if clip_dir is not None:
+            self.frame_ring = FrameRing(
+                write_clip(clip_dir), before=clip_before, after=clip_after
+            )
+        # ZBar, pyzbar, or OpenCV's QRCodeDetector.
+        if not isinstance(backend, ScanBackend):
+            backend = get_backend(backend or 'zbar')
+        self.backend = backend
+        # Optionally, scan on worker threads rather than inline.
+        # The scheduler may be shared with other scanners. Worker threads
+        # only scan in parallel if the backend releases the GIL, otherwise
+        # they would contend with the render loop.
+        if not releases_gil(backend):
+            if scan_workers > 0 or scan_scheduler is not None:
+                logger.warning(
+                    'The {} backend holds the GIL, so scanning '
+                    'inline'.format(backend.name)
+                )
+            scan_workers, scan_scheduler = 0, None
+        if scan_scheduler is None and scan_workers > 0:
+            scan_scheduler = ScanScheduler(self.zbar, scan_workers)
+        self.scan_scheduler = scan_scheduler
+        # Optionally, scan around recently found QR codes first.
+        self.tracker = None
+        if track_qrcodes > 0:
+            self.tracker = QRCodeTracker(
+                max_tracked=track_qrcodes,
+                padding=track_padding,
+                full_scan_interval=full_scan_interval
+            )
+        # For example, ('otsu', 'adaptive', 'clahe', 'gray'). At most
+        # max_strategies are tried per frame, or all if 0.
+        self.binarizer = Binarizer(
+            binarization, max_strategies=max_strategies
+        )
+        # Scan downscaled frames first, for example (0.25, 0.5, 1.0).
+        # Hits and misses per scale, to tune the pyramid.
+        self.pyramid = sorted(scan_pyramid)
+        self.pyramid_hits = dict((scale, 0) for scale in self.pyramid)
+        self.pyramid_misses = dict((scale, 0) for scale in self.pyramid)
+        # Optionally, skip decoding static scenes.
+        self.motion_gate = None
+        if motion_threshold > 0:
+            self.motion_gate = MotionGate(
+                threshold=motion_threshold,
+                rescan_interval=motion_rescan_interval
+            )
+        # Most recent scan result, and the timestamp of its source frame.
+        self.qrcodes = {}
+        self.qrcodes_timestamp = None
         # Highlight scanned QR Codes.
         self.ok_color = ok_color
         self.not_ok_color = not_ok_color
         self.box_width = box_width
         self.successes = 0
+        # Seconds taken by the most recent scan, inline or on a worker.
+        self.decode_latency = None
         self.debug = debug
 
-    def main(self, frame, timestamp):
-        """Main function"""
-        self.before_zbar(timestamp)
-        frame, qrcodes = self.zbar(frame)
-        if len(qrcodes) > 0:
-            self.auth(frame, qrcodes, timestamp)
-        frame = self.after_zbar(frame, qrcodes, timestamp)
+    def main(self, frame, timestamp, scan=True, gray=None, captured=None):
+        """Main function. Frames which aren't scanned are drawn with the
+        most recent result. Gray is the frame's grayscale view, if the
+        camera has one, and captured is when the frame was captured, on the
+        monotonic clock, if known"""
+        self.record_frame(frame)
+        if scan:
+            frame, qrcodes = self.scan_frame(
+                frame, timestamp, gray=gray, captured=captured
+            )
+        else:
+            qrcodes = self.qrcodes
+        with METRICS.timer('draw'):
+            frame = self.after_zbar(frame, qrcodes, timestamp)
         self.process_results_from_queue(timestamp)
         return frame
 
+    def record_frame(self, frame):
+        """Keep the RGB frame as evidence, if clips are enabled. Must be
+        called before drawing onto the frame"""
+        if self.frame_ring is not None and frame is not None:
+            self.frame_ring.add(frame)
+
+    def scan_frame(
+            self, frame, timestamp, gray=None, captured=None, wait=False):
+        """Scan the frame, and auth any QR codes. Doesn't draw.
+
+        Only the grayscale frame is scanned. If gray isn't given, it's
+        converted from the RGB frame. The RGB frame is only needed for
+        auth pictures, so headless scanners without a url may pass None.
+        With scan workers and wait, blocks until the frame is scanned, so
+        none are dropped.
+        """
+        self.before_zbar(timestamp)
+        if gray is None:
+            # Convert to grayscale, as binarization requires
+            with METRICS.timer('color_conversion'):
+                gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        # Skip decoding static scenes, unless a QR code is being tracked.
+        submit = True
+        if self.motion_gate is not None:
+            tracking = len(self.qrcodes) > 0
+            submit = self.motion_gate.should_scan(gray, tracking=tracking)
+            if not submit:
+                METRICS.increment('motion_skipped')
+        if self.scan_scheduler is not None:
+            # Results from frames already submitted are still collected.
+            qrcodes = self.scan_with_scheduler(
+                frame,
+                gray,
+                timestamp,
+                submit=submit,
+                captured=captured,
+                wait=wait
+            )
+        elif not submit:
+            qrcodes = self.qrcodes
+        else:
+            frame, qrcodes = self.zbar(frame, gray=gray, captured=captured)
+            if len(qrcodes) > 0:
+                self.auth(frame, qrcodes, timestamp)
+            self.qrcodes = qrcodes
+            self.qrcodes_timestamp = timestamp
+        return frame, qrcodes
+
+    def scan_with_scheduler(
+            self,
+            frame,
+            gray,
+            timestamp,
+            submit=True,
+            captured=None,
+            wait=False):
+        """Submit the grayscale frame to the scan workers, without blocking
+        unless wait. Returns the most recent result, which may be from an
+        earlier frame"""
+        if submit:
+            # Boxes are drawn onto the RGB frame, never onto the grayscale
+            # frame, so the workers needn't have their own copy.
+            self.scan_scheduler.submit(
+                gray,
+                timestamp,
+                source=self,
+                scan=partial(self.scan_gray, captured=captured)
+            )
+        if wait:
+            result = self.scan_scheduler.wait(source=self)
+        else:
+            result = self.scan_scheduler.get_result(source=self)
+        if result is not None:
+            if len(result.qrcodes) > 0:
+                # The auth picture is taken from the current frame, not yet
+                # drawn onto. It's at most a few frames newer than the frame
+                # that was scanned.
+                self.auth(frame, result.qrcodes, result.timestamp)
+            self.qrcodes = result.qrcodes
+            self.qrcodes_timestamp = result.timestamp
+        return self.qrcodes
+
     def auth(self, frame, qrcodes, timestamp):
-        """Auth with server"""
+        """Auth with server. Every valid QR code in the frame is sent, so
+        people scanning back to back don't wait on each other"""
         if self.url is not None:
-            qrcode = self.get_next_qrcode(frame, qrcodes)
-            if qrcode is not None:
-                if len(self.responses) > self.max_responses:
-                    frame = Image.fromarray(frame)
-                    self.launch_thread(self.url, qrcode, frame, timestamp)
+            for i in range(len(qrcodes)):
+                qrcode = self.get_next_qrcode(frame, qrcodes)
+                if qrcode is None:
+                    break
+                if not self.launch_thread(self.url, qrcode, frame, timestamp):
+                    break
 
     def get_next_qrcode(self, frame, qrcodes):
-        """Returns the largest valid QR code, which is neither the
+        """Returns the largest valid QR code, which is neither an
         active QR code nor throttled"""
         height, width = frame.shape[:2]
         frame_size = width * height
@@ -140,11 +402,11 @@ class QRCodeScanner(object):
         targets = [
             dict(
                 qrcode=qrcode,
-                size=self.qrcode_size(qrcodes[qrcode])
+                size=self.get_qrcode_size(qrcodes[qrcode])
             )
             for qrcode in qrcodes
         ]
-        targets = sorted(targets, key=lambda k: k['size'])
+        targets = sorted(targets, key=lambda k: k['size'], reverse=True)
         for target in targets:
             qrcode = target['qrcode']
             qrcode_size = target['size'] / frame_size
@@ -154,7 +416,7 @@ class QRCodeScanner(object):
                     qrcode_size
                 ))
             # Throttle requests for the same QR code.
-            if self.active_qrcode != qrcode:
+            if qrcode not in self.active_qrcodes:
                 # Throttle requests for cached QR codes.
                 if not self.is_qrcode_throttled(qrcode):
                     # Ensure the QR code is valid.
@@ -163,70 +425,166 @@ class QRCodeScanner(object):
                         logger.info('QRcode is valid: {}'.format(is_valid))
                     if is_valid:
                         if self.max_qrcode_size > 0:
+                            # Too close, but smaller QR codes may be sent.
                             if qrcode_size > self.max_qrcode_size:
-                                self.max_size_exceeded = True
-                                break
-                        if not self.max_size_exceeded:
-                            return qrcode
+                                continue
+                        return qrcode
 
     def is_valid_qrcode(self, qrcode):
         """Intended to be overriden by subclass."""
         return True if qrcode is not None else False
 
     def is_qrcode_throttled(self, qrcode):
-        for throttle in (self.ok_throttle_dict, self.not_ok_throttle_dict):
+        for throttle in (self.ok_throttles, self.not_ok_throttles):
             if qrcode in throttle:
                 return True
 
+    def create_throttle_store(self, name):
+        """Intended to be overridden by subclass, for other throttle stores.
+        Stores provide add, claim, discard, expire and __contains__"""
+        if self.throttle_db is not None:
+            return SQLiteThrottleStore(
+                self.throttle_db, name=name, max_size=self.max_throttled
+            )
+        return ThrottleStore(max_size=self.max_throttled)
+
     def get_qrcode_size(self, qrcode):
         contour = numpy.array(qrcode, dtype=numpy.int32)
         return cv2.contourArea(contour)
 
     def before_zbar(self, timestamp):
-        """Remove expired QR codes from throttle dict"""
-        for throttle in (self.ok_throttle_dict, self.not_ok_throttle_dict):
-            delete = []
-            for qrcode in throttle:
-                expired = (throttle[qrcode] <= datetime.datetime.now())
-                if expired:
-                    delete.append(qrcode)
-            for qrcode in delete:
-                del throttle[qrcode]
-
-    def zbar(self, frame):
+        """Remove expired QR codes from throttle stores"""
+        for throttle in (self.ok_throttles, self.not_ok_throttles):
+            throttle.expire()
+
+    def zbar(self, frame, gray=None, captured=None):
         """Scan frame using ZBar"""
+        if gray is None:
+            # Convert to grayscale, as binarization requires
+            with METRICS.timer('color_conversion'):
+                gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        threshold, qrcodes = self.scan_gray(gray, captured=captured)
+        if self.debug and threshold is not None:
+            if threshold.shape != gray.shape:
+                threshold = cv2.resize(threshold, gray.shape[1::-1])
+            frame = cv2.cvtColor(threshold, cv2.COLOR_GRAY2RGB)
+        return frame, qrcodes
+
+    def scan_gray(self, gray, captured=None):
+        """Scan the grayscale frame, around tracked QR codes first. Returns
+        the last threshold of a full scan, if any, and the QR codes"""
+        start = monotonic()
         qrcodes = {}
-        # Convert to grayscale, as binarization requires
+        threshold = None
+        strategies = self.binarizer.select()
+        if self.tracker is not None:
+            # First, scan the regions around recently found QR codes.
+            height, width = gray.shape[:2]
+            regions = self.tracker.get_regions((width, height))
+            for x, y, w, h in regions:
+                region = gray[y:y + h, x:x + w]
+                _, found = self.scan_strategies(
+                    region, offset=(x, y), strategies=strategies
+                )
+                qrcodes.update(found)
+            if regions:
+                self.tracker.update(qrcodes)
+        if not qrcodes:
+            threshold, qrcodes = self.scan_pyramid(
+                gray, strategies=strategies
+            )
+            if self.tracker is not None:
+                self.tracker.update(qrcodes, full_scan=True)
+        self.decode_latency = monotonic() - start
+        if captured is not None:
+            METRICS.observe('glass_to_decode', monotonic() - captured)
+        return threshold, qrcodes
+
+    def scan_batch(self, frames, workers=None):
+        """Scan many RGB frames in parallel, if the backend releases the
+        GIL. Returns the QR codes found in each frame, in order. Frames are
+        independent, so QR codes aren't tracked, and nothing is authed"""
+        if not releases_gil(self.backend):
+            # Threads would only take turns holding the GIL.
+            return [self.decode(frame) for frame in frames]
+        pool = ThreadPool(workers)
+        try:
+            return pool.map(self.decode, frames)
+        finally:
+            pool.close()
+            pool.join()
+
+    def decode(self, frame):
+        """Scan the full RGB frame, without tracking"""
         gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        # Apply Otsu Binarization
-        _, threshold = cv2.threshold(
-            gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
-        )
+        _, qrcodes = self.scan_pyramid(gray)
+        return qrcodes
+
+    def scan_pyramid(self, gray, strategies=None):
+        """Scan the frame at each scale of the pyramid, smallest first.
+        Stops at the first scale that finds QR codes"""
+        if strategies is None:
+            strategies = self.binarizer.select()
+        height, width = gray.shape[:2]
+        for scale in self.pyramid:
+            if scale == 1.0:
+                image = gray
+            else:
+                size = int(width * scale), int(height * scale)
+                image = cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+            threshold, qrcodes = self.scan_strategies(
+                image, scale=scale, strategies=strategies
+            )
+            if qrcodes:
+                self.pyramid_hits[scale] += 1
+                break
+            self.pyramid_misses[scale] += 1
+        return threshold, qrcodes
+
+    def scan_strategies(
+            self, gray, offset=(0, 0), scale=1.0, strategies=None):
+        """Binarize and scan with each strategy selected for the frame, best
+        first. Stops at the first strategy that finds QR codes"""
+        if strategies is None:
+            strategies = self.binarizer.select()
+        for strategy in strategies:
+            start = monotonic()
+            threshold = strategy(gray)
+            thresholded = monotonic()
+            qrcodes = self.scan(threshold, offset=offset, scale=scale)
+            end = monotonic()
+            METRICS.observe('threshold', thresholded - start)
+            METRICS.observe('decode', end - thresholded)
+            self.binarizer.record(strategy, bool(qrcodes), end - start)
+            if qrcodes:
+                break
+        return threshold, qrcodes
+
+    def scan(self, threshold, offset=(0, 0), scale=1.0):
+        """Scan a binarized image using the backend. Locations are scaled and
+        offset, so that they are relative to the full frame"""
+        qrcodes = {}
         try:
-            # Convert to string, as ZBar requires
-            pil_image = Image.fromarray(threshold)
-            width, height = pil_image.size
-            raw = pil_image.tostring()
-        except:
-            logger.error('Error converting to PIL image')
+            results = self.backend.scan(threshold)
+        except cv2.error:
+            # OpenCV's detector fails on some degenerate images. Anything
+            # else is a broken backend, which should fail loudly.
+            logger.exception(
+                'Error scanning with {}'.format(self.backend.name)
+            )
         else:
-            try:
-                image = zbar.Image(width, height, 'Y800', raw)
-            except:
-                logger.error('Error converting to ZBar image')
-            else:
-                self.scanner.scan(image)
-                for qrcode in image:
-                    location = []
-                    for point in qrcode.location:
-                        location.append(point)
-                    qrcodes[qrcode.data] = location
+            for data, points in results:
+                location = []
+                for x, y in points:
+                    location.append((
+                        int(x / scale) + offset[0],
+                        int(y / scale) + offset[1]
+                    ))
+                qrcodes[data] = location
 
-                    if self.debug:
-                        self.successes += 1
-        if self.debug:
-            frame = cv2.cvtColor(threshold, cv2.COLOR_GRAY2RGB)
-        return frame, qrcodes
+                if self.debug:
+                    self.successes += 1
+        return qrcodes
 
     def after_zbar(self, frame, qrcodes, timestamp):
         """Intended to be overridden by subclass. Currently, draws boxes
@@ -234,76 +592,112 @@ class QRCodeScanner(object):
         frame = self.draw_boxes(qrcodes, frame)
         return frame
 
+    def draw_boxes(self, qrcodes, frame):
+        """Draw boxes around QR codes, OK QR codes in ok_color, and others
+        in not_ok_color. Boxes of the same color are drawn in one call"""
+        ok, not_ok = [], []
+        for qrcode, location in qrcodes.items():
+            boxes = ok if qrcode in self.ok_throttles else not_ok
+            boxes.append(location)
+        for boxes, color in ((ok, self.ok_color), (not_ok, self.not_ok_color)):
+            if boxes:
+                self.draw_box(frame, boxes, color, self.box_width)
+        return frame
+
     def draw_box(self, frame, location, color, width):
-        """Draw a box around around QR code"""
-        for index in range(len(location)):
-            if (index + 1) == len(location):
-                next_index = 0
-            else:
-                next_index = index + 1
-            # From OpenCV 3.0.0, cv2.LINE_AA was renamed cv2.CV_AA
-            if cv2.__version__ >= '3.0.0':
-                cv2.line(
-                    frame,
-                    location[index], location[next_index],
-                    color,
-                    width,
-                    lineType=cv2.LINE_AA
-                )
-            else:
-                cv2.line(
-                    frame,
-                    location[index], location[next_index],
-                    color,
-                    width,
-                    cv2.CV_AA
-                )
+        """Draw a box around around QR code. Location may also be a list of
+        locations, to draw many boxes at once"""
+        if len(location) and numpy.ndim(location[0]) == 1:
+            location = [location]
+        points = [
+            numpy.array(box, dtype=numpy.int32).reshape(-1, 1, 2)
+            for box in location
+        ]
+        cv2.polylines(frame, points, True, color, width, LINE_AA)
         return frame
 
     def is_thread_running(self):
-        """Check if the thread is running"""
-        # Is a thread active?
-        if self.thread is not None:
-            if self.thread.is_alive():
+        """Check if an auth request is queued"""
+        if self.auth_pool is not None:
+            if self.auth_pool.pending() > 0:
                 return True
 
     def launch_thread(self, url, qrcode, frame, timestamp):
-        """Launch a thread to auth against server with requests library"""
-        try:
-            self.thread = Thread(
-                target=server_auth,
-                args=(
-                    self.queue,
-                    url,
-                    qrcode,
-                    Image.fromarray(frame),
-                    timestamp
-                )
-            ).start()
-        except:
-            logger.error('Thread failed to start')
-        else:
+        """Submit to the auth worker pool, which auths against server with
+        requests library. Returns False if the request was dropped"""
+        if self.auth_pool is None and self.async_auth:
+            # Requires Python 3.
+            from asyncauth import AsyncAuthClient
+            self.auth_pool = AsyncAuthClient(
+                self.queue,
+                url,
+                max_in_flight=self.auth_workers,
+                timeout=self.timeout,
+                retries=self.auth_retries,
+                quality=self.picture_quality,
+                scale=1.0
+            )
+        elif self.auth_pool is None:
+            self.auth_pool = AuthWorkerPool(
+                server_auth,
+                self.queue,
+                url,
+                workers=self.auth_workers,
+                max_queue=self.auth_queue_size,
+                timeout=self.timeout,
+                retries=self.auth_retries,
+                kwargs=dict(quality=self.picture_quality, scale=1.0)
+            )
+        # Throttle requests. Claiming is atomic, so with a shared throttle
+        # store only one scanner sends the QR code.
+        if not self.not_ok_throttles.claim(qrcode, self.not_ok_throttle):
+            return True
+        submitted = self.auth_pool.submit(
+            qrcode, self.get_picture(frame), timestamp
+        )
+        if submitted:
             self.after_thread_started(qrcode, timestamp)
+            if self.frame_ring is not None:
+                self.frame_ring.trigger(qrcode, timestamp)
+        else:
+            self.not_ok_throttles.discard(qrcode)
+        return submitted
+
+    def get_picture(self, frame):
+        """Boxes are drawn onto the frame, so the pool needs its own copy.
+        Downscaling makes one, without copying the full resolution frame"""
+        if self.picture_scale != 1.0:
+            return cv2.resize(
+                frame,
+                None,
+                fx=self.picture_scale,
+                fy=self.picture_scale,
+                interpolation=cv2.INTER_AREA
+            )
+        return frame.copy()
 
     def after_thread_started(self, qrcode, timestamp):
-        """Runs after thread is started. Throttles not OK results"""
-        # Throttle requests
-        self.not_ok_throttle_dict[qrcode] = (
-            timestamp + datetime.timedelta(seconds=self.not_ok_throttle)
-        )
-        self.active_qrcode = qrcode
-        logger.info('Sent QRcode to server {}'.format(self.active_qrcode))
+        """Runs after thread is started. Not OK results are already
+        throttled"""
+        self.active_qrcodes.add(qrcode)
+        logger.info('Sent QRcode to server {}'.format(qrcode))
+
+    def cancel_auth(self, qrcode):
+        """Cancel an in flight auth, if the auth client supports it"""
+        cancel = getattr(self.auth_pool, 'cancel', None)
+        if cancel is not None and cancel(qrcode):
+            self.active_qrcodes.discard(qrcode)
 
     def process_results_from_queue(self, timestamp):
-        """Throttles OK results. Prepares response for GUI"""
-        if not self.queue.empty():
+        """Throttles OK results. Prepares responses for GUI. Drains every
+        result on the queue"""
+        while not self.queue.empty():
+            qrcode, response = self.queue.get_nowait()
             # Clear active qrcode
-            self.active_qrcode = None
-            response = self.queue.get()
+            self.active_qrcodes.discard(qrcode)
             if response is not None:
                 # Response is OK. Flag the QR code as OK, and throttle it
                 if 'qrcode' in response:
                     qrcode = response['qrcode']
-                    ok_throttle = datetime.timedelta(seconds=self.ok_throttle)
-                    self.ok_throttle_dict[qrcode] = timestamp + ok_throttle
+                    self.ok_throttles.add(qrcode, self.ok_throttle)
                     self.responses.append(response)
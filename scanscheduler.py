@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import logging
+from collections import namedtuple, OrderedDict
+from threading import Thread, Condition
+from compat import monotonic
+
+logger = logging.getLogger(__name__)
+
+ScanResult = namedtuple('ScanResult', ['timestamp', 'frame', 'qrcodes'])
+
+
+class ScanScheduler(object):
+    """Scan frames on a pool of worker threads, latest frame wins.
+
+    submit() never blocks. While every worker is busy, a newly submitted
+    frame replaces the pending one, which is dropped. Results are returned
+    with the timestamp of their source frame, and results older than one
+    already returned are discarded.
+
+    Several sources, for example cameras, may share the pool. Each source
+    has its own pending frame and result, and workers take pending frames
+    round robin.
+
+    Sources which mustn't drop frames, such as video files, call wait()
+    after each submit(), so every frame is scanned.
+    """
+    def __init__(self, scan=None, workers=1):
+        self.scan = scan
+        self.dropped_frames = 0
+        self.stale_results = 0
+        # Seconds taken by the most recent scan, per source.
+        self.latency = {}
+        self._pending = OrderedDict()
+        self._results = {}
+        self._last_timestamps = {}
+        # Frames being scanned, per source.
+        self._scanning = {}
+        self._stopped = False
+        self._condition = Condition()
+        self._threads = []
+        for i in range(workers):
+            thread = Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, frame, timestamp, source=None, scan=None):
+        """Queue the frame for scanning, replacing any pending frame from
+        the same source"""
+        scan = scan or self.scan
+        with self._condition:
+            if source in self._pending:
+                self.dropped_frames += 1
+            # Replacing a pending frame keeps the source's place in line.
+            self._pending[source] = (frame, timestamp, scan)
+            self._condition.notify()
+
+    def get_result(self, source=None):
+        """Return the newest result not yet returned, or None"""
+        with self._condition:
+            result = self._results.pop(source, None)
+            if result is not None:
+                self._last_timestamps[source] = result.timestamp
+            return result
+
+    def wait(self, source=None):
+        """Block until the source's pending frame, and any frame being
+        scanned, is done. Returns the newest result not yet returned, or
+        None"""
+        with self._condition:
+            while not self._stopped and (
+                source in self._pending or self._scanning.get(source)
+            ):
+                self._condition.wait()
+        return self.get_result(source)
+
+    def _is_stale(self, source, timestamp):
+        """Is a newer result pending, or already returned?"""
+        result = self._results.get(source)
+        if result is not None and result.timestamp >= timestamp:
+            return True
+        last = self._last_timestamps.get(source)
+        return last is not None and last >= timestamp
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                source, (frame, timestamp, scan) = self._pending.popitem(
+                    last=False
+                )
+                self._scanning[source] = self._scanning.get(source, 0) + 1
+            start = monotonic()
+            try:
+                frame, qrcodes = scan(frame)
+            except Exception:
+                logger.exception('Error scanning frame')
+                qrcodes = None
+            with self._condition:
+                self._scanning[source] -= 1
+                # Wake wait(), as well as the workers.
+                self._condition.notify_all()
+                if qrcodes is None:
+                    continue
+                self.latency[source] = monotonic() - start
+                if self._is_stale(source, timestamp):
+                    self.stale_results += 1
+                else:
+                    self._results[source] = ScanResult(
+                        timestamp, frame, qrcodes
+                    )
+
+    def stop(self):
+        """Stop the workers, after they finish the current frame"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
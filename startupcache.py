@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def read_attribute(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def device_identity(device):
+    """A stable identity for the device, so that a configuration cached for
+    one camera isn't used for another plugged into the same index.
+
+    On Linux, the V4L2 name, and USB vendor, product and serial number, of
+    camera indexes. Otherwise, the device itself.
+    """
+    identity = [str(device)]
+    if isinstance(device, int):
+        path = '/sys/class/video4linux/video{}'.format(device)
+        identity.append(read_attribute(os.path.join(path, 'name')))
+        # The USB device is the parent of the video interface.
+        for attribute in ('idVendor', 'idProduct', 'serial'):
+            identity.append(read_attribute(
+                os.path.join(path, 'device', '..', attribute)
+            ))
+    return ':'.join(part for part in identity if part)
+
+
+class StartupCache(object):
+    """Configuration negotiated on a previous start, as JSON on disk.
+
+    Without a path, nothing is loaded nor saved. A missing or corrupt file
+    is an empty cache, so the configuration is negotiated again.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.values = {}
+        self.changed = False
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.values = json.load(f)
+            except (IOError, OSError, ValueError):
+                logger.warning('Ignoring startup cache {}'.format(path))
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def set(self, key, value):
+        # JSON has no tuples, so compare as lists.
+        if isinstance(value, tuple):
+            value = list(value)
+        if self.values.get(key) != value:
+            self.values[key] = value
+            self.changed = True
+
+    def save(self):
+        """Write the cache, if changed. Written to a temporary file first, so
+        a reboot while writing can't leave a partial file"""
+        if self.path is None or not self.changed:
+            return
+        temporary = '{}.tmp'.format(self.path)
+        try:
+            with open(temporary, 'w') as f:
+                json.dump(self.values, f, indent=2, sort_keys=True)
+            if os.path.exists(self.path) and os.name == 'nt':
+                # Python 2.7 can't replace files on Windows.
+                os.remove(self.path)
+            os.rename(temporary, self.path)
+        except (IOError, OSError) as e:
+            logger.warning('Could not save startup cache: {}'.format(e))
+        else:
+            self.changed = False
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import threading
+from email.parser import BytesParser
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2.7
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+import pytest
+
+# The modules are at the root of the repo.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def parse_form(content_type, body):
+    """Form fields, and files, of a multipart/form-data body"""
+    message = BytesParser().parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+    )
+    fields = {}
+    for part in message.get_payload():
+        name = part.get_param('name', header='content-disposition')
+        fields[name] = part.get_payload(decode=True)
+    return fields
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """A local auth server. respond(request) returns (status, body), and
+    every request is recorded as a dict of path, port and form fields"""
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.requests = []
+        self.delay = 0.0
+        self.respond = self.echo
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server_address[1])
+
+    def echo(self, request):
+        """Auth every QR code, or every QR code in a batch"""
+        if 'batch' in request['form']:
+            batch = json.loads(request['form']['batch'].decode('utf-8'))
+            return 200, [dict(qrcode=entry['qrcode']) for entry in batch]
+        return 200, dict(qrcode=request['form']['qrcode'].decode('utf-8'))
+
+    def handle_error(self, request, client_address):
+        # Clients that time out close the connection before the response.
+        pass
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    # Keep alive.
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = self.rfile.read(length)
+        request = dict(
+            path=self.path,
+            port=self.client_address[1],
+            form=parse_form(self.headers['Content-Type'], body)
+        )
+        with self.server.lock:
+            self.server.requests.append(request)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        status, response = self.server.respond(request)
+        if isinstance(response, (dict, list)):
+            response = json.dumps(response)
+        response = response.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(predicate, timeout=5.0):
+    """Poll until predicate is true, or fail"""
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import datetime
+from queue import Queue
+import numpy
+from asyncauth import AsyncAuthClient
+from conftest import wait_for
+
+PICTURE = numpy.zeros((36, 64, 3), dtype=numpy.uint8)
+
+
+def create_client(url, **kwargs):
+    queue = Queue()
+    return queue, AsyncAuthClient(queue, url, **kwargs)
+
+
+def results(queue, count):
+    wait_for(lambda: queue.qsize() >= count)
+    return [queue.get_nowait() for i in range(count)]
+
+
+def test_auth(stub_server):
+    queue, client = create_client(stub_server.url)
+    try:
+        client.submit('a', PICTURE, datetime.datetime.now())
+        assert results(queue, 1) == [('a', dict(qrcode='a'))]
+        wait_for(lambda: client.pending() == 0)
+    finally:
+        client.stop()
+
+
+def test_started_request_is_not_cancelled(stub_server):
+    stub_server.delay = 0.3
+    queue, client = create_client(stub_server.url)
+    try:
+        client.submit('a', PICTURE, datetime.datetime.now())
+        wait_for(lambda: len(stub_server.requests) == 1)
+        assert not client.cancel('a')
+        # The server authed it, so the response isn't dropped.
+        assert results(queue, 1) == [('a', dict(qrcode='a'))]
+    finally:
+        client.stop()
+
+
+def test_cancel_before_start(stub_server):
+    stub_server.delay = 0.3
+    queue, client = create_client(stub_server.url, max_in_flight=1)
+    try:
+        client.submit('a', PICTURE, datetime.datetime.now())
+        wait_for(lambda: len(stub_server.requests) == 1)
+        # Waits for a, as only one request is in flight at once.
+        client.submit('b', PICTURE, datetime.datetime.now())
+        assert client.cancel('b')
+        assert sorted(results(queue, 2)) == [
+            ('a', dict(qrcode='a')), ('b', None)
+        ]
+        wait_for(lambda: client.pending() == 0)
+    finally:
+        client.stop()
+    assert len(stub_server.requests) == 1
+    assert client.cancelled == 1
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import json
+import sqlite3
+import time
+import datetime
+try:
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+import numpy
+import pytest
+from authjournal import AuthJournal
+from conftest import wait_for
+
+PICTURE = numpy.zeros((36, 64, 3), dtype=numpy.uint8)
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('journal.db'))
+
+
+def create_journal(url, path, **kwargs):
+    queue = Queue()
+    kwargs.setdefault('backoff', 0.01)
+    return queue, AuthJournal(queue, url, path, **kwargs)
+
+
+def submit(journal, *qrcodes):
+    for qrcode in qrcodes:
+        journal.submit(qrcode, PICTURE, datetime.datetime.now())
+
+
+def results(queue, count):
+    wait_for(lambda: queue.qsize() >= count)
+    return [queue.get_nowait() for i in range(count)]
+
+
+def batch(request):
+    entries = json.loads(request['form']['batch'].decode('utf-8'))
+    return [entry['qrcode'] for entry in entries]
+
+
+def test_batch(stub_server, path):
+    queue, journal = create_journal(
+        stub_server.url, path, batch_size=3, linger=60
+    )
+    try:
+        submit(journal, 'a', 'b', 'c')
+        assert results(queue, 3) == [
+            ('a', dict(qrcode='a')),
+            ('b', dict(qrcode='b')),
+            ('c', dict(qrcode='c'))
+        ]
+    finally:
+        journal.stop()
+    assert [batch(r) for r in stub_server.requests] == [['a', 'b', 'c']]
+    # With a picture for each entry.
+    assert 'picture_2' in stub_server.requests[0]['form']
+    assert journal.sent == 3
+    assert journal.pending() == 0
+
+
+def test_linger(stub_server, path):
+    queue, journal = create_journal(
+        stub_server.url, path, batch_size=10, linger=0.3
+    )
+    try:
+        started = time.time()
+        submit(journal, 'a', 'b')
+        assert results(queue, 2) == [
+            ('a', dict(qrcode='a')), ('b', dict(qrcode='b'))
+        ]
+        assert time.time() - started >= 0.3
+    finally:
+        journal.stop()
+    assert [batch(r) for r in stub_server.requests] == [['a', 'b']]
+
+
+def test_outage_then_replay(stub_server, path):
+    stub_server.respond = lambda request: (503, 'Service Unavailable')
+    queue, journal = create_journal(
+        stub_server.url, path, linger=0, max_attempts=1
+    )
+    try:
+        submit(journal, 'a', 'b')
+        # Reported once, however many times the upload fails.
+        assert sorted(results(queue, 2)) == [
+            ('a', dict(network_timeout=True)),
+            ('b', dict(network_timeout=True))
+        ]
+        wait_for(lambda: journal.failures >= 3)
+        assert queue.empty()
+    finally:
+        journal.stop()
+    # Outages are never dead lettered.
+    assert journal.dead == 0
+    assert journal.pending() == 2
+    stub_server.respond = stub_server.echo
+    queue, journal = create_journal(stub_server.url, path, linger=0)
+    try:
+        assert sorted(results(queue, 2)) == [
+            ('a', dict(qrcode='a')), ('b', dict(qrcode='b'))
+        ]
+    finally:
+        journal.stop()
+    assert journal.pending() == 0
+
+
+def test_poison_entry(stub_server, path):
+    stub_server.respond = lambda request: (
+        (400, 'Bad Request') if 'poison' in batch(request)
+        else stub_server.echo(request)
+    )
+    queue, journal = create_journal(
+        stub_server.url, path, batch_size=3, linger=60, max_attempts=2
+    )
+    try:
+        submit(journal, 'a', 'poison', 'b')
+        assert results(queue, 3) == [
+            ('a', dict(qrcode='a')),
+            ('poison', None),
+            ('b', dict(qrcode='b'))
+        ]
+        # Later entries aren't held back.
+        submit(journal, 'c', 'd', 'e')
+        assert len(results(queue, 3)) == 3
+    finally:
+        journal.stop()
+    assert [batch(r) for r in stub_server.requests] == [
+        ['a', 'poison', 'b'],
+        ['a'],
+        ['poison'],
+        ['poison'],
+        ['b'],
+        ['c', 'd', 'e']
+    ]
+    assert journal.dead == 1
+    assert journal.pending() == 0
+
+
+def test_unencodable_entry(stub_server, path):
+    queue, journal = create_journal(
+        stub_server.url, path, linger=0, max_attempts=1
+    )
+    try:
+        # JSON can't encode bytes, on Python 3.
+        submit(journal, b'\xff')
+        assert results(queue, 1) == [(b'\xff', None)]
+    finally:
+        journal.stop()
+    assert stub_server.requests == []
+
+
+@pytest.mark.parametrize('reply', [[], [1, 2], dict(qrcode='a'), 'html'])
+def test_unexpected_reply(stub_server, path, reply):
+    stub_server.respond = lambda request: (200, json.dumps(reply))
+    queue, journal = create_journal(
+        stub_server.url, path, linger=0, max_attempts=1
+    )
+    try:
+        submit(journal, 'a')
+        assert results(queue, 1) == [('a', None)]
+    finally:
+        journal.stop()
+
+
+def test_bad_path(stub_server, tmpdir):
+    path = str(tmpdir.join('missing', 'journal.db'))
+    with pytest.raises(sqlite3.Error):
+        create_journal(stub_server.url, path)
+
+
+def test_write_failed(stub_server, path):
+    queue, journal = create_journal(stub_server.url, path, linger=0)
+    try:
+        submit(journal, 'a')
+        assert results(queue, 1) == [('a', dict(qrcode='a'))]
+        # For example, the disk is full.
+        connection = sqlite3.connect(path)
+        connection.execute('DROP TABLE journal')
+        connection.close()
+        submit(journal, 'b', 'c')
+        # Otherwise, the QR codes would stay active forever.
+        assert sorted(results(queue, 2)) == [('b', None), ('c', None)]
+        assert journal._thread.is_alive()
+        assert journal.pending() == 0
+    finally:
+        journal.stop()
+    assert [batch(r) for r in stub_server.requests] == [['a']]
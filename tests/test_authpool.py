@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+import datetime
+try:
+    from Queue import Queue
+except ImportError:
+    # Python 3
+    from queue import Queue
+import numpy
+import pytest
+import requests
+from requests.packages.urllib3.exceptions import NewConnectionError
+from authpool import AuthWorkerPool
+from conftest import wait_for
+from qrcodescanner import post, server_auth
+
+PICTURE = numpy.zeros((36, 64, 3), dtype=numpy.uint8)
+
+
+def create_pool(url, **kwargs):
+    queue = Queue()
+    kwargs.setdefault('retries', 0)
+    return queue, AuthWorkerPool(server_auth, queue, url, **kwargs)
+
+
+def results(queue, count):
+    wait_for(lambda: queue.qsize() >= count)
+    return [queue.get_nowait() for i in range(count)]
+
+
+def test_auth(stub_server):
+    queue, pool = create_pool(stub_server.url)
+    try:
+        assert pool.submit('a', PICTURE, datetime.datetime.now())
+        assert results(queue, 1) == [('a', dict(qrcode='a'))]
+    finally:
+        pool.stop()
+
+
+def test_keep_alive(stub_server):
+    queue, pool = create_pool(stub_server.url, workers=1)
+    try:
+        for i in range(5):
+            pool.submit(str(i), PICTURE, datetime.datetime.now())
+            results(queue, 1)
+    finally:
+        pool.stop()
+    # Every request was sent over the same connection.
+    assert len(stub_server.requests) == 5
+    assert len(set(r['port'] for r in stub_server.requests)) == 1
+
+
+def test_drop_when_full(stub_server):
+    stub_server.delay = 0.5
+    queue, pool = create_pool(stub_server.url, workers=1, max_queue=1)
+    try:
+        assert pool.submit('a', PICTURE, datetime.datetime.now())
+        wait_for(lambda: len(stub_server.requests) == 1)
+        # The worker is busy with a, so b is queued and c is dropped.
+        assert pool.submit('b', PICTURE, datetime.datetime.now())
+        assert not pool.submit('c', PICTURE, datetime.datetime.now())
+        assert pool.dropped == 1
+        assert sorted(results(queue, 2)) == [
+            ('a', dict(qrcode='a')), ('b', dict(qrcode='b'))
+        ]
+    finally:
+        pool.stop()
+
+
+def test_invalid_response_is_a_result(stub_server):
+    stub_server.respond = lambda request: (502, '<html>Bad Gateway</html>')
+    queue, pool = create_pool(stub_server.url)
+    try:
+        pool.submit('a', PICTURE, datetime.datetime.now())
+        # Otherwise, the QR code would stay active forever.
+        assert results(queue, 1) == [('a', None)]
+    finally:
+        pool.stop()
+
+
+def test_read_timeout_is_not_retried(stub_server):
+    stub_server.delay = 0.5
+    queue, pool = create_pool(stub_server.url, timeout=0.1, retries=2)
+    try:
+        pool.submit('a', PICTURE, datetime.datetime.now())
+        assert results(queue, 1) == [('a', dict(network_timeout=True))]
+    finally:
+        pool.stop()
+    # The server may have authed the first request, so it isn't resent.
+    assert len(stub_server.requests) == 1
+
+
+class FailingSession(object):
+    """Fails to connect, failures times"""
+    def __init__(self, failures):
+        self.failures = failures
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        if self.posts <= self.failures:
+            reason = NewConnectionError(None, 'Connection refused')
+            error = requests.exceptions.ConnectionError(
+                requests.packages.urllib3.exceptions.MaxRetryError(
+                    None, url, reason
+                )
+            )
+            raise error
+        return 'response'
+
+
+def test_retry_connect_errors_with_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr('qrcodescanner.time.sleep', sleeps.append)
+    session = FailingSession(2)
+    response = post(session, 'url', {}, {}, retries=2, backoff=0.5)
+    assert response == 'response'
+    assert session.posts == 3
+    assert sleeps == [0.5, 1.0]
+
+
+def test_retries_exhausted(monkeypatch):
+    monkeypatch.setattr('qrcodescanner.time.sleep', lambda seconds: None)
+    session = FailingSession(3)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        post(session, 'url', {}, {}, retries=2)
+    assert session.posts == 3
+
+
+def test_connection_refused(monkeypatch):
+    monkeypatch.setattr('qrcodescanner.time.sleep', lambda seconds: None)
+    # Nothing listens on port 9 (discard), on loopback.
+    queue, pool = create_pool('http://127.0.0.1:9/', retries=1)
+    try:
+        pool.submit('a', PICTURE, datetime.datetime.now())
+        assert results(queue, 1) == [('a', None)]
+    finally:
+        pool.stop()
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import os
+import cv2
+import numpy
+import pytest
+# No screen is needed.
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+pygame = pytest.importorskip('pygame')
+from camera import FrameArrayCaptureManager, ThreadedCV2CaptureManager
+from conftest import wait_for
+from multicamera import MultiCameraWindow
+
+
+def qrcode_frame(data, size=(320, 240)):
+    """An RGB frame, with a QR code in the middle"""
+    qrcode = cv2.QRCodeEncoder.create().encode(data)
+    qrcode = cv2.resize(qrcode, (160, 160), interpolation=cv2.INTER_NEAREST)
+    frame = numpy.full((size[1], size[0]), 255, dtype=numpy.uint8)
+    x, y = (size[0] - 160) // 2, (size[1] - 160) // 2
+    frame[y:y + 160, x:x + 160] = qrcode
+    return cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
+
+
+def synthetic(data):
+    return FrameArrayCaptureManager([qrcode_frame(data)], loop=True)
+
+
+@pytest.fixture
+def create_window():
+    windows = []
+
+    def create(devices, **kwargs):
+        kwargs.setdefault('scan_backend', 'opencv')
+        window = MultiCameraWindow(
+            devices=devices, fullscreen=False, **kwargs
+        )
+        windows.append(window)
+        return window
+    yield create
+    for window in windows:
+        if window.scan_scheduler is not None:
+            window.scan_scheduler.stop()
+    pygame.display.quit()
+
+
+def run_until(window, predicate):
+    def step():
+        window.event_loop()
+        return predicate()
+    wait_for(step)
+
+
+def test_tiles(create_window):
+    window = create_window([synthetic('left'), synthetic('right')])
+    # The scan workers are shared, and every camera is round robined.
+    assert window.scan_scheduler is not None
+    run_until(window, lambda: all(s.qrcodes for s in window.scanners))
+    assert [list(s.qrcodes) for s in window.scanners] == [
+        ['left'], ['right']
+    ]
+    # Side by side.
+    (x0, y0, w0, h0), (x1, y1, w1, h1) = window.tiles
+    assert (x0, y0, y1) == (0, 0, 0) and x1 == w0
+    for x, y, w, h in window.tiles:
+        assert window.frame_buffer[y:y + h, x:x + w].any()
+    stats = window.get_camera_stats()
+    assert [s['device'] for s in stats] == [0, 1]
+    assert all(s['decode_latency'] > 0 for s in stats)
+
+
+def test_inline_decode_latency(create_window):
+    window = create_window(
+        [synthetic('left'), synthetic('right')], scan_workers=0
+    )
+    window.scan_scheduler = None
+    for scanner in window.scanners:
+        scanner.scan_scheduler = None
+    window.event_loop()
+    assert all(
+        s['decode_latency'] > 0 for s in window.get_camera_stats()
+    )
+
+
+def test_shared_throttles(create_window, stub_server):
+    window = create_window(
+        [synthetic('same'), synthetic('same')], url=stub_server.url
+    )
+    first, second = window.scanners
+    assert first.not_ok_throttles is second.not_ok_throttles
+    run_until(window, lambda: first.responses or second.responses)
+    for i in range(10):
+        window.event_loop()
+    # Both cameras see the QR code, but it's only authed once.
+    assert len(stub_server.requests) == 1
+
+
+def test_video_files(create_window, tmpdir):
+    path = str(tmpdir.join('qrcode.avi'))
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (320, 240)
+    )
+    for i in range(10):
+        writer.write(qrcode_frame('file'))
+    writer.release()
+    window = create_window([path, path])
+    for camera in window.cameras:
+        assert not isinstance(camera, ThreadedCV2CaptureManager)
+    frames = 0
+    while not all(camera.exhausted for camera in window.cameras):
+        window.event_loop()
+        frames += 1
+        assert frames <= 11
+    # Every frame is scanned.
+    assert all(s.qrcodes for s in window.scanners)
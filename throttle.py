@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+import time
+import heapq
+import sqlite3
+from threading import Lock
+from collections import OrderedDict
+from compat import monotonic
+
+
+class ThrottleStore(object):
+    """QR codes which are throttled until they expire.
+
+    Lookups are O(1), against a dict of expiry times. Expiry is amortized
+    O(log n), with a min heap of expiry times. Heap entries which were
+    superseded, or evicted, are skipped when popped. Once the store holds
+    max_size QR codes, the least recently added is evicted.
+    """
+    def __init__(self, max_size=10000, clock=monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self.evictions = 0
+        # QR code to expiry time, least recently added first.
+        self._expiry = OrderedDict()
+        self._heap = []
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def __contains__(self, qrcode):
+        expires = self._expiry.get(qrcode)
+        if expires is None:
+            return False
+        if expires <= self.clock():
+            del self._expiry[qrcode]
+            return False
+        return True
+
+    def add(self, qrcode, seconds):
+        """Throttle the QR code for seconds"""
+        expires = self.clock() + seconds
+        # Re-insert, so the QR code is the most recently added.
+        self._expiry.pop(qrcode, None)
+        self._expiry[qrcode] = expires
+        heapq.heappush(self._heap, (expires, qrcode))
+        while len(self._expiry) > self.max_size:
+            self._expiry.popitem(last=False)
+            self.evictions += 1
+        # Superseded entries accumulate in the heap, so occasionally
+        # rebuild it.
+        if len(self._heap) > 2 * len(self._expiry) + 64:
+            self._heap = [
+                (expires, qrcode)
+                for qrcode, expires in self._expiry.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def claim(self, qrcode, seconds):
+        """Throttle the QR code for seconds, unless already throttled.
+        Returns True if the QR code was claimed"""
+        if qrcode in self:
+            return False
+        self.add(qrcode, seconds)
+        return True
+
+    def discard(self, qrcode):
+        self._expiry.pop(qrcode, None)
+
+    def expire(self):
+        """Remove expired QR codes"""
+        now = self.clock()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expires, qrcode = heapq.heappop(heap)
+            # Skip superseded, or evicted, entries.
+            if self._expiry.get(qrcode) == expires:
+                del self._expiry[qrcode]
+
+
+class SQLiteThrottleStore(object):
+    """Throttled QR codes, shared with other processes on the host by way
+    of an SQLite database.
+
+    claim() is atomic across processes, so a QR code is sent once per
+    throttle window whichever scanner sees it first. Expiry times use the
+    wall clock, as monotonic clocks aren't shared between processes.
+    """
+    def __init__(
+        self,
+        path,
+        name='throttle',
+        max_size=10000,
+        expire_interval=1.0,
+        clock=time.time
+    ):
+        self.name = name
+        self.max_size = max_size
+        self.expire_interval = expire_interval
+        self.clock = clock
+        self.expired_at = None
+        self.lock = Lock()
+        # Autocommit, with explicit transactions where required.
+        self.connection = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False
+        )
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS {} ('
+                'qrcode TEXT PRIMARY KEY, expires REAL, added REAL)'.format(
+                    name
+                )
+            )
+            self.connection.execute(
+                'CREATE INDEX IF NOT EXISTS {0}_expires ON {0} (expires)'
+                .format(name)
+            )
+
+    def __len__(self):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT COUNT(*) FROM {} WHERE expires > ?'.format(self.name),
+                (self.clock(), )
+            ).fetchone()
+        return row[0]
+
+    def __contains__(self, qrcode):
+        with self.lock:
+            return self._is_throttled(qrcode, self.clock())
+
+    def _is_throttled(self, qrcode, now):
+        row = self.connection.execute(
+            'SELECT 1 FROM {} WHERE qrcode = ? AND expires > ?'.format(
+                self.name
+            ),
+            (qrcode, now)
+        ).fetchone()
+        return row is not None
+
+    def _add(self, qrcode, seconds, now):
+        self.connection.execute(
+            'INSERT OR REPLACE INTO {} (qrcode, expires, added) '
+            'VALUES (?, ?, ?)'.format(self.name),
+            (qrcode, now + seconds, now)
+        )
+
+    def add(self, qrcode, seconds):
+        """Throttle the QR code for seconds"""
+        with self.lock:
+            self._add(qrcode, seconds, self.clock())
+
+    def claim(self, qrcode, seconds):
+        """Throttle the QR code for seconds, unless already throttled by any
+        process. Returns True if the QR code was claimed"""
+        with self.lock:
+            now = self.clock()
+            connection = self.connection
+            # Take the write lock before reading.
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if self._is_throttled(qrcode, now):
+                    return False
+                self._add(qrcode, seconds, now)
+            finally:
+                connection.execute('COMMIT')
+            return True
+
+    def discard(self, qrcode):
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM {} WHERE qrcode = ?'.format(self.name),
+                (qrcode, )
+            )
+
+    def expire(self):
+        """Remove expired QR codes, then evict the least recently added QR
+        codes over max_size. At most once per expire_interval"""
+        now = self.clock()
+        if self.expired_at is not None:
+            if now - self.expired_at < self.expire_interval:
+                return
+        self.expired_at = now
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM {} WHERE expires <= ?'.format(self.name), (now, )
+            )
+            self.connection.execute(
+                'DELETE FROM {0} WHERE qrcode NOT IN ('
+                'SELECT qrcode FROM {0} ORDER BY added DESC LIMIT ?)'.format(
+                    self.name
+                ),
+                (self.max_size, )
+            )
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+from threading import Lock
+
+
+def bounding_rect(location, padding, frame_size):
+    """Returns the padded bounding rect of a QR code location, as
+    (x, y, w, h), clipped to the frame"""
+    width, height = frame_size
+    xs = [point[0] for point in location]
+    ys = [point[1] for point in location]
+    pad = int(max(max(xs) - min(xs), max(ys) - min(ys)) * padding)
+    x1 = max(min(xs) - pad, 0)
+    y1 = max(min(ys) - pad, 0)
+    x2 = min(max(xs) + pad, width)
+    y2 = min(max(ys) + pad, height)
+    return x1, y1, x2 - x1, y2 - y1
+
+
+class QRCodeTracker(object):
+    """Keeps the last N QR code locations, so that only the area around them
+    need be scanned. A full frame scan is required every K frames, or when
+    the tracked regions miss."""
+    def __init__(self, max_tracked=4, padding=0.5, full_scan_interval=15):
+        self.padding = padding
+        self.full_scan_interval = full_scan_interval
+        self.locations = deque(maxlen=max_tracked)
+        self.frames_since_full_scan = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+
+    def get_regions(self, frame_size):
+        """Returns regions to scan, as (x, y, w, h), or an empty list if a
+        full frame scan is due"""
+        with self.lock:
+            self.frames_since_full_scan += 1
+            if self.frames_since_full_scan >= self.full_scan_interval:
+                return []
+            regions = []
+            for location in self.locations:
+                x, y, w, h = bounding_rect(location, self.padding, frame_size)
+                if w > 0 and h > 0:
+                    regions.append((x, y, w, h))
+            return regions
+
+    def update(self, qrcodes, full_scan=False):
+        """Track the locations of the QR codes that were found"""
+        with self.lock:
+            if full_scan:
+                self.frames_since_full_scan = 0
+            elif qrcodes:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if full_scan or qrcodes:
+                self.locations.clear()
+                for qrcode in qrcodes:
+                    self.locations.append(qrcodes[qrcode])